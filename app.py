@@ -1,22 +1,37 @@
 import os
 import base64
+import copy
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import logging
-from flask import Flask, request, jsonify, render_template, session, redirect, url_for
+from flask import Flask, Blueprint, request, jsonify, render_template, session, redirect, url_for, g, has_app_context, send_from_directory, stream_with_context
+from flask.json.provider import JSONProvider
+from flask_session import Session
 from datetime import datetime, date, timedelta
 from dotenv import load_dotenv
 from werkzeug.security import generate_password_hash, check_password_hash
-from functools import wraps
+from functools import wraps, lru_cache
+from cachetools import LRUCache, TTLCache
 import secrets
-import json
+import orjson
 import hashlib
+import re
+import threading
+import tempfile
+import queue
+from concurrent.futures import ThreadPoolExecutor
+from collections import Counter
+import time
+import decimal
 
 # Database imports - use PostgreSQL on Render, SQLite locally
 DATABASE_URL = os.getenv('DATABASE_URL')
 if DATABASE_URL:
     # Running on Render with PostgreSQL
     import psycopg2
-    from psycopg2.extras import RealDictCursor
+    import psycopg2.pool
+    from psycopg2.extras import RealDictCursor, execute_values
     from urllib.parse import urlparse
     
     # Parse the DATABASE_URL
@@ -50,23 +65,95 @@ FATSECRET_ACCESS_TOKEN = os.getenv("FATSECRET_ACCESS_TOKEN") # Switched to Acces
 
 app = Flask(__name__, template_folder='templates', static_folder='static')
 
-# IMPORTANT: Use a fixed secret key for session persistence across restarts
-SECRET_KEY = os.getenv('SECRET_KEY')
-if not SECRET_KEY:
-    # Generate a persistent secret key if not in environment
-    SECRET_KEY = 'your-fixed-secret-key-change-this-in-production-' + secrets.token_hex(16)
+_ORJSON_OPTIONS = orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS
+
+def _orjson_default(obj):
+    if isinstance(obj, decimal.Decimal):
+        return str(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+class OrjsonProvider(JSONProvider):
+    """jsonify() and request.json backed by orjson; keys stay sorted like Flask's default"""
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=_orjson_default, option=_ORJSON_OPTIONS).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        # Hand the encoded bytes straight to the response, skipping the str round-trip
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(orjson.dumps(obj, default=_orjson_default, option=_ORJSON_OPTIONS),
+                                        mimetype='application/json')
+
+app.json = OrjsonProvider(app)
+
+# Sessions are stored server-side (Redis when REDIS_URL is set, files otherwise);
+# the cookie only carries a session id, signed with SECRET_KEY so clients can't pick their own
+SECRET_KEY_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.secret_key')
+
+def load_secret_key():
+    """SECRET_KEY from the environment, else one generated once and kept in SECRET_KEY_FILE"""
+    key = os.getenv('SECRET_KEY')
+    if key:
+        return key
     logging.warning("Using generated SECRET_KEY. Set SECRET_KEY environment variable for production!")
+    if not os.path.exists(SECRET_KEY_FILE):
+        # Write a complete key to a temp file, then link it into place: readers see the
+        # whole key or no file, and when workers start at once the first link wins
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(SECRET_KEY_FILE))
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(secrets.token_hex(32))
+            os.link(tmp_path, SECRET_KEY_FILE)
+        except FileExistsError:
+            pass
+        finally:
+            os.unlink(tmp_path)
+    with open(SECRET_KEY_FILE) as f:
+        return f.read().strip()
+
+SECRET_KEY = load_secret_key()
+REDIS_URL = os.getenv('REDIS_URL')
 
 app.secret_key = SECRET_KEY
+if REDIS_URL:
+    import redis
+    app.config['SESSION_TYPE'] = 'redis'
+    app.config['SESSION_REDIS'] = redis.from_url(REDIS_URL)
+else:
+    app.config['SESSION_TYPE'] = 'filesystem'
+app.config['SESSION_USE_SIGNER'] = True
 app.config['SESSION_COOKIE_HTTPONLY'] = True
 app.config['SESSION_COOKIE_SAMESITE'] = 'Lax'
 app.config['SESSION_COOKIE_SECURE'] = False  # Set to True if using HTTPS
 app.config['SESSION_COOKIE_NAME'] = 'health_tracker_session'
 app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(days=7)  # Session lasts 7 days
 app.config['SESSION_REFRESH_EACH_REQUEST'] = False  # Don't refresh session on every request
+Session(app)
 
 DATABASE = 'database.db'
+SQLITE_POOL_SIZE = 8  # Most SQLite connections checked out at once; further callers wait
+HTTP_TIMEOUT = (3, 30)  # (connect, read) seconds for Gemini/FatSecret calls
+API_CACHE_MEMORY_TTL = 3600  # Seconds an api_cache row stays in the in-process cache
+SQLITE_OPTIMIZE_INTERVAL = 15 * 60  # Seconds between background PRAGMA optimize runs
+CACHE_PURGE_INTERVAL = 60 * 60  # Seconds between purges of expired cache rows
+FOOD_CACHE_MAX_AGE_DAYS = 90  # food_cache rows older than this are purged
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg'}
+UPLOAD_DIR = os.path.abspath(os.getenv('UPLOAD_DIR', 'uploads'))  # Meal photos, stored as <sha256>.<jpg|png>
+MEAL_IMAGE_MAX_AGE = 365 * 24 * 3600  # Content-addressed, so browsers may cache forever
+# Verified against when the username is unknown so both login failures cost one hash check
+DUMMY_HASH = generate_password_hash(secrets.token_hex(16))
+
+# Shared HTTP session: keeps TCP/TLS connections to Gemini and FatSecret alive between calls
+_HTTP = requests.Session()
+_HTTP.mount("https://", HTTPAdapter(
+    pool_connections=10,
+    pool_maxsize=20,
+    max_retries=Retry(total=2, backoff_factor=0.2, status_forcelist=[429, 500, 502, 503, 504])
+))
+# Shared worker pool for concurrent FatSecret lookups; matches the HTTP pool size per host
+_NUTRITION_POOL = ThreadPoolExecutor(max_workers=8, thread_name_prefix='nutrition')
 
 # --- 2. STARTUP CHECKS ---
 if not GEMINI_API_KEY:
@@ -75,24 +162,147 @@ if not FATSECRET_ACCESS_TOKEN:
     logging.warning("FATSECRET_ACCESS_TOKEN environment variable not set. Nutrition lookup will fail.")
 
 # --- DATABASE HELPERS ---
+# PostgreSQL connections come from a shared pool; SQLite ones from a bounded LIFO pool,
+# with one connection pinned per request in g
+_PG_POOL = None
+if DATABASE_URL:
+    _PG_POOL = psycopg2.pool.ThreadedConnectionPool(
+        minconn=2,
+        maxconn=20,
+        cursor_factory=RealDictCursor,
+        **db_config
+    )
+# Idle SQLite connections, most recently used first so warm statement caches get reused;
+# the semaphore counts checked-out connections and blocks callers once the pool is exhausted
+_sqlite_pool = queue.LifoQueue()
+_sqlite_pool_slots = threading.BoundedSemaphore(SQLITE_POOL_SIZE)
+
+def _open_sqlite():
+    # Room for every hoisted SQL_* statement plus the cache/helper queries;
+    # pooled connections move between threads, hence check_same_thread=False
+    db = sqlite3.connect(DATABASE, cached_statements=512, check_same_thread=False)
+    db.row_factory = sqlite3.Row
+    if DATABASE != ':memory:':
+        # journal_mode=WAL is persisted in the file header by init_db();
+        # the rest are per-connection settings
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.execute("PRAGMA temp_store=MEMORY")
+        db.execute("PRAGMA mmap_size=268435456")
+        db.execute("PRAGMA cache_size=-20000")
+    return db
+
+def _checkout_sqlite():
+    _sqlite_pool_slots.acquire()
+    try:
+        return _sqlite_pool.get_nowait()
+    except queue.Empty:
+        try:
+            return _open_sqlite()
+        except Exception:
+            _sqlite_pool_slots.release()
+            raise
+
+def _return_sqlite(db):
+    if db.in_transaction:
+        # Drop uncommitted work so the next borrower starts clean
+        db.rollback()
+    _sqlite_pool.put(db)
+    _sqlite_pool_slots.release()
+
 def get_db():
     if DATABASE_URL:
         # PostgreSQL for production (Render)
-        conn = psycopg2.connect(
-            database=db_config['database'],
-            user=db_config['user'],
-            password=db_config['password'],
-            host=db_config['host'],
-            port=db_config['port'],
-            cursor_factory=RealDictCursor
-        )
+        conn = _PG_POOL.getconn()
+        if has_app_context():
+            # Remember the checkout so it is returned even if the caller forgets
+            g.setdefault('_pg_conns', []).append(conn)
         return conn
     else:
         # SQLite for local development
-        db = sqlite3.connect(DATABASE)
-        db.row_factory = sqlite3.Row
+        if not has_app_context():
+            return _checkout_sqlite()
+        # One pooled connection per request, so helpers called by a route share
+        # its transaction instead of contending with it for the write lock
+        db = g.get('_sqlite_conn')
+        if db is None:
+            db = g._sqlite_conn = _checkout_sqlite()
         return db
 
+def release_db(db):
+    """Hand a connection from get_db() back for reuse"""
+    if DATABASE_URL:
+        if has_app_context() and db in g.get('_pg_conns', []):
+            g._pg_conns.remove(db)
+        _PG_POOL.putconn(db)
+    elif has_app_context() and g.get('_sqlite_conn') is db:
+        # The request keeps its connection until teardown; drop uncommitted work like close() did
+        if db.in_transaction:
+            db.rollback()
+    else:
+        _return_sqlite(db)
+
+@app.teardown_appcontext
+def release_request_connections(exc):
+    """Return any connections a request left checked out"""
+    if DATABASE_URL:
+        for conn in g.pop('_pg_conns', []):
+            _PG_POOL.putconn(conn)
+    else:
+        db = g.pop('_sqlite_conn', None)
+        if db is not None:
+            _return_sqlite(db)
+
+def _run_periodically(interval, job, description):
+    """Run job every interval seconds, forever, logging (not raising) failures"""
+    while True:
+        time.sleep(interval)
+        try:
+            job()
+        except Exception as e:
+            logging.error(f"{description} failed: {e}")
+
+def sqlite_optimize():
+    """Let SQLite refresh its query planner statistics"""
+    db = get_db()
+    db.execute("PRAGMA optimize")
+    release_db(db)
+
+def start_background_jobs():
+    """Start the daemon threads for periodic database maintenance"""
+    jobs = [(CACHE_PURGE_INTERVAL, purge_expired_cache, 'Cache purge')]
+    if not DATABASE_URL and DATABASE != ':memory:':
+        jobs.append((SQLITE_OPTIMIZE_INTERVAL, sqlite_optimize, 'PRAGMA optimize'))
+    for interval, job, description in jobs:
+        thread = threading.Thread(target=_run_periodically, args=(interval, job, description), daemon=True)
+        thread.start()
+
+_INSERT_OR_REPLACE_RE = re.compile(r'INSERT OR REPLACE INTO (\w+)\s*\((.*?)\)')
+
+@lru_cache(maxsize=256)
+def _translate_query_for_postgres(query):
+    """Rewrite an SQLite-style query for PostgreSQL (memoized - call sites pass fixed strings)"""
+    # Replace ? with %s for PostgreSQL
+    query = query.replace('?', '%s')
+    # Handle INSERT OR REPLACE
+    if 'INSERT OR REPLACE' in query:
+        # Extract table and columns for ON CONFLICT
+        match = _INSERT_OR_REPLACE_RE.search(query)
+        if match:
+            columns = match.group(2)
+            # Assume first column is unique
+            first_col = columns.split(',')[0].strip()
+            query = query.replace('INSERT OR REPLACE', 'INSERT')
+            query = query.rstrip(')') + f') ON CONFLICT ({first_col}) DO UPDATE SET '
+            # Add update clause for all columns
+            col_list = [c.strip() for c in columns.split(',')]
+            updates = [f"{c} = EXCLUDED.{c}" for c in col_list if c != first_col]
+            query += ', '.join(updates)
+    
+    if query.strip().upper().startswith('INSERT') and 'RETURNING' not in query.upper():
+        # Ask PostgreSQL for the new id in the same statement
+        query = query.rstrip('; \n') + ' RETURNING id'
+    return query
+
 def execute_db_query(query, params=None, commit=False, fetchone=False):
     """Execute a database query with proper parameter handling for both PostgreSQL and SQLite"""
     db = get_db()
@@ -100,24 +310,8 @@ def execute_db_query(query, params=None, commit=False, fetchone=False):
     
     # Convert query for PostgreSQL if needed
     if DATABASE_URL:
-        # Replace ? with %s for PostgreSQL
-        query = query.replace('?', '%s')
-        # Handle INSERT OR REPLACE
-        if 'INSERT OR REPLACE' in query:
-            # Extract table and columns for ON CONFLICT
-            import re
-            match = re.search(r'INSERT OR REPLACE INTO (\w+)\s*\((.*?)\)', query)
-            if match:
-                table = match.group(1)
-                columns = match.group(2)
-                # Assume first column is unique
-                first_col = columns.split(',')[0].strip()
-                query = query.replace('INSERT OR REPLACE', 'INSERT')
-                query = query.rstrip(')') + f') ON CONFLICT ({first_col}) DO UPDATE SET '
-                # Add update clause for all columns
-                col_list = [c.strip() for c in columns.split(',')]
-                updates = [f"{c} = EXCLUDED.{c}" for c in col_list if c != first_col]
-                query += ', '.join(updates)
+        query = _translate_query_for_postgres(query)
+    is_insert = query.strip().upper().startswith('INSERT')
     
     try:
         if params:
@@ -128,43 +322,28 @@ def execute_db_query(query, params=None, commit=False, fetchone=False):
         if commit:
             db.commit()
         
-        if fetchone:
-            result = cursor.fetchone()
-        else:
-            result = cursor.fetchall()
-        
         # Get lastrowid for inserts
-        if query.strip().upper().startswith('INSERT'):
+        if is_insert:
             if DATABASE_URL:
-                # For PostgreSQL, we need to add RETURNING id
-                if 'RETURNING id' not in query:
-                    db.close()
-                    # Re-execute with RETURNING
-                    db = get_db()
-                    cursor = db.cursor()
-                    query = query.rstrip(';') + ' RETURNING id'
-                    if params:
-                        cursor.execute(query, params)
-                    else:
-                        cursor.execute(query)
-                    if commit:
-                        db.commit()
-                    result = cursor.fetchone()
-                    lastrowid = result['id'] if result else None
-                else:
-                    lastrowid = result['id'] if result else None
+                result = cursor.fetchone()
+                lastrowid = result['id'] if result else None
             else:
                 lastrowid = cursor.lastrowid
             cursor.close()
-            db.close()
+            release_db(db)
             return lastrowid
         
+        if fetchone:
+            result = cursor.fetchone()
+        else:
+            result = cursor.fetchall()
+        
         cursor.close()
-        db.close()
+        release_db(db)
         return result
         
     except Exception as e:
-        db.close()
+        release_db(db)
         raise e
 
 def execute_query(query, params=None, commit=False):
@@ -174,6 +353,9 @@ def execute_query(query, params=None, commit=False):
     if DATABASE_URL:
         # PostgreSQL
         cursor = db.cursor()
+        if query.strip().upper().startswith('INSERT') and 'RETURNING' not in query.upper():
+            # Ask PostgreSQL for the new id in the same statement
+            query = query.rstrip('; \n') + ' RETURNING id'
         if params:
             cursor.execute(query, params)
         else:
@@ -185,22 +367,17 @@ def execute_query(query, params=None, commit=False):
         if query.strip().upper().startswith('SELECT'):
             result = cursor.fetchall()
             cursor.close()
-            db.close()
+            release_db(db)
             return result
         elif query.strip().upper().startswith('INSERT'):
             # Get the last inserted id for PostgreSQL
-            if 'RETURNING id' not in query:
-                query = query.rstrip(';') + ' RETURNING id'
-                cursor.execute(query, params)
             last_id = cursor.fetchone()['id'] if cursor.rowcount > 0 else None
-            if commit:
-                db.commit()
             cursor.close()
-            db.close()
+            release_db(db)
             return last_id
         else:
             cursor.close()
-            db.close()
+            release_db(db)
             return None
     else:
         # SQLite
@@ -220,252 +397,394 @@ def execute_query(query, params=None, commit=False):
         else:
             result = None
             
-        db.close()
+        release_db(db)
         return result
 
+# --- SCHEMA ---
+# Abstract column types rendered per database as (PostgreSQL, SQLite)
+SCHEMA_TYPES = {
+    'PK': ('SERIAL PRIMARY KEY', 'INTEGER PRIMARY KEY AUTOINCREMENT'),
+    'STR': ('VARCHAR(255)', 'TEXT'),
+    'SHORTSTR': ('VARCHAR(50)', 'TEXT'),
+    'DATE': ('DATE', 'TEXT'),
+    'TS': ('TIMESTAMP', 'TEXT'),
+}
+
+# Display order of meal types; stored in meals.meal_type_id so listings sort on an integer
+MEAL_TYPE_IDS = {'breakfast': 0, 'lunch': 1, 'snacks': 2, 'dinner': 3}
+
+# Table name -> list of (column, type spec) pairs or table-level constraint strings.
+# The first word of a type spec is looked up in SCHEMA_TYPES; anything else is used as-is.
+SCHEMA = {
+    'users': [
+        ('id', 'PK'),
+        ('username', 'STR UNIQUE NOT NULL'),
+        ('password_hash', 'TEXT NOT NULL'),
+        ('email', 'STR UNIQUE'),
+        ('created_at', 'TS NOT NULL'),
+        ('name', 'STR'),
+        ('age', 'INTEGER'),
+        ('height', 'REAL'),
+        ('target_calories', 'INTEGER DEFAULT 2000'),
+    ],
+    'vitals': [
+        ('id', 'PK'),
+        ('user_id', 'INTEGER NOT NULL'),
+        ('date', 'DATE NOT NULL'),
+        ('weight', 'REAL'),
+        ('bmi', 'REAL'),
+        ('body_fat_percentage', 'REAL'),
+        ('skeletal_muscle_percentage', 'REAL'),
+        ('fat_free_mass', 'REAL'),
+        ('subcutaneous_fat', 'REAL'),
+        ('visceral_fat', 'REAL'),
+        ('body_water_percentage', 'REAL'),
+        ('muscle_mass', 'REAL'),
+        ('bone_mass', 'REAL'),
+        ('protein_percentage', 'REAL'),
+        ('bmr', 'REAL'),
+        ('metabolic_age', 'INTEGER'),
+        'FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE',
+    ],
+    'meals': [
+        ('id', 'PK'),
+        ('user_id', 'INTEGER NOT NULL'),
+        ('date', 'DATE NOT NULL'),
+        ('meal_type', 'SHORTSTR NOT NULL'),
+        ('meal_type_id', 'INTEGER'),
+        ('food_items', 'TEXT'),
+        ('calories', 'REAL'),
+        ('protein', 'REAL'),
+        ('fat', 'REAL'),
+        ('carbohydrates', 'REAL'),
+        ('image_data', 'TEXT'),
+        ('created_at', 'TS NOT NULL'),
+        'FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE',
+    ],
+    'activities': [
+        ('id', 'PK'),
+        ('user_id', 'INTEGER NOT NULL'),
+        ('date', 'DATE NOT NULL'),
+        ('activity_name', 'STR NOT NULL'),
+        ('duration_minutes', 'INTEGER'),
+        ('calories_burned', 'REAL'),
+        ('notes', 'TEXT'),
+        ('created_at', 'TS NOT NULL'),
+        'FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE',
+    ],
+    'daily_summary': [
+        ('id', 'PK'),
+        ('user_id', 'INTEGER NOT NULL'),
+        ('date', 'DATE NOT NULL'),
+        ('total_calories_consumed', 'REAL DEFAULT 0'),
+        ('total_calories_burned', 'REAL DEFAULT 0'),
+        ('net_calories', 'REAL DEFAULT 0'),
+        ('total_protein', 'REAL DEFAULT 0'),
+        ('total_fat', 'REAL DEFAULT 0'),
+        ('total_carbs', 'REAL DEFAULT 0'),
+        ('water_intake_ml', 'REAL DEFAULT 0'),
+        ('notes', 'TEXT'),
+        'UNIQUE(user_id, date)',
+        'FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE',
+    ],
+    'api_cache': [
+        ('id', 'PK'),
+        ('cache_key', 'STR UNIQUE NOT NULL'),
+        ('response_data', 'TEXT NOT NULL'),
+        ('created_at', 'TS NOT NULL'),
+        ('expires_at', 'TS NOT NULL'),
+    ],
+    'food_cache': [
+        ('id', 'PK'),
+        ('food_name', 'STR UNIQUE NOT NULL'),
+        ('calories', 'REAL'),
+        ('protein', 'REAL'),
+        ('fat', 'REAL'),
+        ('carbohydrates', 'REAL'),
+        ('serving_size', "SHORTSTR DEFAULT '100g'"),
+        ('last_updated', 'TS NOT NULL'),
+    ],
+}
+
+# Indexes for the hot lookups (same DDL works on both databases).
+# api_cache.cache_key and daily_summary(user_id, date) already have UNIQUE indexes.
+# Every per-user table leads an index with user_id, so user-scoped lookups and
+# cascading deletes never scan; daily_summary is covered by its UNIQUE(user_id, date)
+SCHEMA_INDEXES = [
+    'CREATE INDEX IF NOT EXISTS idx_food_cache_lower ON food_cache (LOWER(food_name))',
+    # Covering indexes: the daily summary SUMs are answered from the index alone
+    'CREATE INDEX IF NOT EXISTS idx_meals_sum ON meals (user_id, date, calories, protein, fat, carbohydrates)',
+    # Serves the per-day meal listing in display order without a sort step
+    'CREATE INDEX IF NOT EXISTS idx_meals_order ON meals (user_id, date, meal_type_id)',
+    'CREATE INDEX IF NOT EXISTS idx_activities_sum ON activities (user_id, date, calories_burned)',
+    # Also answers "latest weight" (ORDER BY date DESC LIMIT 1) by walking it backwards
+    'CREATE INDEX IF NOT EXISTS idx_vitals_user_date ON vitals (user_id, date)',
+    # Superseded by the covering indexes above, which share their (user_id, date) prefix
+    'DROP INDEX IF EXISTS idx_meals_user_date',
+    'DROP INDEX IF EXISTS idx_activities_user_date',
+]
+
+# SQLite-only DDL. stats_cache holds db_manager's view_user_stats aggregates so
+# scripted `stats` calls within its TTL skip the scans. Files created before the
+# schema declared ON DELETE CASCADE keep their old foreign keys, so a trigger
+# carries the cascade. IF NOT EXISTS keeps concurrent init_db runs from racing
+# and never leaves a window without the trigger
+SQLITE_SCHEMA_EXTRAS = [
+    '''CREATE TABLE IF NOT EXISTS stats_cache (
+    user_id INTEGER PRIMARY KEY,
+    computed_at INTEGER NOT NULL,
+    meals_count INTEGER,
+    activities_count INTEGER,
+    vitals_count INTEGER,
+    weight REAL,
+    avg_calories REAL
+)''',
+    '''CREATE TRIGGER IF NOT EXISTS trg_user_delete AFTER DELETE ON users
+    BEGIN
+        DELETE FROM meals WHERE user_id = OLD.id;
+        DELETE FROM activities WHERE user_id = OLD.id;
+        DELETE FROM vitals WHERE user_id = OLD.id;
+        DELETE FROM daily_summary WHERE user_id = OLD.id;
+        DELETE FROM stats_cache WHERE user_id = OLD.id;
+    END''',
+]
+
+# Columns added after their table first shipped: (table, column, type, backfill SQL).
+# CREATE TABLE IF NOT EXISTS leaves existing tables alone, so init_db adds these by hand.
+SCHEMA_ADDED_COLUMNS = [
+    ('meals', 'meal_type_id', 'INTEGER',
+     "UPDATE meals SET meal_type_id = CASE meal_type "
+     + " ".join(f"WHEN '{name}' THEN {type_id}" for name, type_id in MEAL_TYPE_IDS.items())
+     + " END"),
+]
+
+def render_schema_sql(postgres):
+    """All CREATE TABLE/INDEX statements for one database flavour"""
+    flavour = 0 if postgres else 1
+    statements = []
+    for table, entries in SCHEMA.items():
+        lines = []
+        for entry in entries:
+            if isinstance(entry, str):
+                lines.append(entry)
+                continue
+            column, spec = entry
+            kind, _, rest = spec.partition(' ')
+            if kind in SCHEMA_TYPES:
+                kind = SCHEMA_TYPES[kind][flavour]
+            lines.append(f"{column} {kind} {rest}".rstrip())
+        statements.append(f"CREATE TABLE IF NOT EXISTS {table} (\n    " + ",\n    ".join(lines) + "\n)")
+    statements.extend(SCHEMA_INDEXES)
+    if not postgres:
+        statements.extend(SQLITE_SCHEMA_EXTRAS)
+    return ";\n".join(statements) + ";"
+
+def migrate_schema(db):
+    """Add SCHEMA_ADDED_COLUMNS missing from existing tables and backfill them"""
+    cursor = db.cursor()
+    for table, column, column_type, backfill_sql in SCHEMA_ADDED_COLUMNS:
+        if DATABASE_URL:
+            cursor.execute("SELECT column_name FROM information_schema.columns WHERE table_name = %s", (table,))
+            columns = {row['column_name'] for row in cursor.fetchall()}
+        else:
+            columns = {row[1] for row in cursor.execute(f"PRAGMA table_info({table})")}
+        # No columns means the table doesn't exist yet and CREATE TABLE will include it
+        if columns and column not in columns:
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}")
+            cursor.execute(backfill_sql)
+            logging.info(f"Added column {table}.{column}")
+
+def migrate_legacy_meal_images(db):
+    """Move photos stored inline as base64 (before UPLOAD_DIR) out to files, keeping only the hash"""
+    cursor = db.cursor()
+    cursor.execute("SELECT id FROM meals WHERE LENGTH(image_data) > 64")
+    legacy_ids = [row['id'] for row in cursor.fetchall()]
+    # Both statements re-check the legacy condition: another worker running init_db at the
+    # same time may already have swapped a row to its hash, which itself decodes as base64
+    select_sql = "SELECT image_data FROM meals WHERE id = ? AND LENGTH(image_data) > 64"
+    update_sql = "UPDATE meals SET image_data = ? WHERE id = ? AND LENGTH(image_data) > 64"
+    if DATABASE_URL:
+        select_sql, update_sql = _translate_query_for_postgres(select_sql), _translate_query_for_postgres(update_sql)
+    moved = 0
+    # One row at a time, so only a single decoded image is held in memory
+    for meal_id in legacy_ids:
+        cursor.execute(select_sql, (meal_id,))
+        row = cursor.fetchone()
+        if row is None:
+            continue
+        try:
+            image_bytes = base64.b64decode(row['image_data'], validate=True)
+        except ValueError:
+            # Cleared so later startups don't rescan and re-warn about the row
+            logging.warning(f"Meal {meal_id} has undecodable image data; dropping it")
+            cursor.execute(update_sql, (None, meal_id))
+            continue
+        cursor.execute(update_sql, (store_meal_image(image_bytes), meal_id))
+        moved += cursor.rowcount
+    if moved:
+        logging.info(f"Moved {moved} legacy meal images to {UPLOAD_DIR}")
+
 def init_db():
     with app.app_context():
         db = get_db()
+        schema_sql = render_schema_sql(postgres=bool(DATABASE_URL))
         
         if DATABASE_URL:
-            # PostgreSQL schema
+            # PostgreSQL accepts the whole script in one round-trip
+            migrate_schema(db)
             cursor = db.cursor()
-            
-            # Users table
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS users (
-                    id SERIAL PRIMARY KEY,
-                    username VARCHAR(255) UNIQUE NOT NULL,
-                    password_hash TEXT NOT NULL,
-                    email VARCHAR(255) UNIQUE,
-                    created_at TIMESTAMP NOT NULL,
-                    name VARCHAR(255),
-                    age INTEGER,
-                    height REAL,
-                    target_calories INTEGER DEFAULT 2000
-                )
-            ''')
+            cursor.execute(schema_sql)
         else:
-            # SQLite schema
-            cursor = db.cursor()
-            
-            # Users table
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS users (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    username TEXT UNIQUE NOT NULL,
-                    password_hash TEXT NOT NULL,
-                    email TEXT UNIQUE,
-                    created_at TEXT NOT NULL,
-                    name TEXT,
-                    age INTEGER,
-                    height REAL,
-                    target_calories INTEGER DEFAULT 2000
-                )
-            ''')
-        
-        # Vitals table
-        if DATABASE_URL:
-            # PostgreSQL
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS vitals (
-                    id SERIAL PRIMARY KEY,
-                    user_id INTEGER NOT NULL,
-                    date DATE NOT NULL,
-                    weight REAL,
-                    bmi REAL,
-                    body_fat_percentage REAL,
-                    skeletal_muscle_percentage REAL,
-                    fat_free_mass REAL,
-                    subcutaneous_fat REAL,
-                    visceral_fat REAL,
-                    body_water_percentage REAL,
-                    muscle_mass REAL,
-                    bone_mass REAL,
-                    protein_percentage REAL,
-                    bmr REAL,
-                    metabolic_age INTEGER,
-                    FOREIGN KEY (user_id) REFERENCES users (id)
-                )
-            ''')
-        else:
-            # SQLite
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS vitals (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER NOT NULL,
-                    date TEXT NOT NULL,
-                    weight REAL,
-                    bmi REAL,
-                    body_fat_percentage REAL,
-                    skeletal_muscle_percentage REAL,
-                    fat_free_mass REAL,
-                    subcutaneous_fat REAL,
-                    visceral_fat REAL,
-                    body_water_percentage REAL,
-                    muscle_mass REAL,
-                    bone_mass REAL,
-                    protein_percentage REAL,
-                    bmr REAL,
-                    metabolic_age INTEGER,
-                    FOREIGN KEY (user_id) REFERENCES users (id)
-                )
-            ''')
-        
-        # Meals table
-        if DATABASE_URL:
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS meals (
-                    id SERIAL PRIMARY KEY,
-                    user_id INTEGER NOT NULL,
-                    date DATE NOT NULL,
-                    meal_type VARCHAR(50) NOT NULL,
-                    food_items TEXT,
-                    calories REAL,
-                    protein REAL,
-                    fat REAL,
-                    carbohydrates REAL,
-                    image_data TEXT,
-                    created_at TIMESTAMP NOT NULL,
-                    FOREIGN KEY (user_id) REFERENCES users (id)
-                )
-            ''')
-        else:
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS meals (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER NOT NULL,
-                    date TEXT NOT NULL,
-                    meal_type TEXT NOT NULL,
-                    food_items TEXT,
-                    calories REAL,
-                    protein REAL,
-                    fat REAL,
-                    carbohydrates REAL,
-                    image_data TEXT,
-                    created_at TEXT NOT NULL,
-                    FOREIGN KEY (user_id) REFERENCES users (id)
-                )
-            ''')
-        
-        # Activities table
-        if DATABASE_URL:
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS activities (
-                    id SERIAL PRIMARY KEY,
-                    user_id INTEGER NOT NULL,
-                    date DATE NOT NULL,
-                    activity_name VARCHAR(255) NOT NULL,
-                    duration_minutes INTEGER,
-                    calories_burned REAL,
-                    notes TEXT,
-                    created_at TIMESTAMP NOT NULL,
-                    FOREIGN KEY (user_id) REFERENCES users (id)
-                )
-            ''')
-        else:
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS activities (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER NOT NULL,
-                    date TEXT NOT NULL,
-                    activity_name TEXT NOT NULL,
-                    duration_minutes INTEGER,
-                    calories_burned REAL,
-                    notes TEXT,
-                    created_at TEXT NOT NULL,
-                    FOREIGN KEY (user_id) REFERENCES users (id)
-                )
-            ''')
-        
-        # Daily summary table
-        if DATABASE_URL:
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS daily_summary (
-                    id SERIAL PRIMARY KEY,
-                    user_id INTEGER NOT NULL,
-                    date DATE NOT NULL,
-                    total_calories_consumed REAL DEFAULT 0,
-                    total_calories_burned REAL DEFAULT 0,
-                    net_calories REAL DEFAULT 0,
-                    total_protein REAL DEFAULT 0,
-                    total_fat REAL DEFAULT 0,
-                    total_carbs REAL DEFAULT 0,
-                    water_intake_ml REAL DEFAULT 0,
-                    notes TEXT,
-                    UNIQUE(user_id, date),
-                    FOREIGN KEY (user_id) REFERENCES users (id)
-                )
-            ''')
-        else:
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS daily_summary (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER NOT NULL,
-                    date TEXT NOT NULL,
-                    total_calories_consumed REAL DEFAULT 0,
-                    total_calories_burned REAL DEFAULT 0,
-                    net_calories REAL DEFAULT 0,
-                    total_protein REAL DEFAULT 0,
-                    total_fat REAL DEFAULT 0,
-                    total_carbs REAL DEFAULT 0,
-                    water_intake_ml REAL DEFAULT 0,
-                    notes TEXT,
-                    UNIQUE(user_id, date),
-                    FOREIGN KEY (user_id) REFERENCES users (id)
-                )
-            ''')
-        
-        # Cache tables
-        if DATABASE_URL:
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS api_cache (
-                    id SERIAL PRIMARY KEY,
-                    cache_key VARCHAR(255) UNIQUE NOT NULL,
-                    response_data TEXT NOT NULL,
-                    created_at TIMESTAMP NOT NULL,
-                    expires_at TIMESTAMP NOT NULL
-                )
-            ''')
-            
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS food_cache (
-                    id SERIAL PRIMARY KEY,
-                    food_name VARCHAR(255) UNIQUE NOT NULL,
-                    calories REAL,
-                    protein REAL,
-                    fat REAL,
-                    carbohydrates REAL,
-                    serving_size VARCHAR(50) DEFAULT '100g',
-                    last_updated TIMESTAMP NOT NULL
-                )
-            ''')
-        else:
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS api_cache (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    cache_key TEXT UNIQUE NOT NULL,
-                    response_data TEXT NOT NULL,
-                    created_at TEXT NOT NULL,
-                    expires_at TEXT NOT NULL
-                )
-            ''')
-            
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS food_cache (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    food_name TEXT UNIQUE NOT NULL,
-                    calories REAL,
-                    protein REAL,
-                    fat REAL,
-                    carbohydrates REAL,
-                    serving_size TEXT DEFAULT '100g',
-                    last_updated TEXT NOT NULL
-                )
-            ''')
-        
+            # Lets the purge job hand freed pages back; must precede any table creation,
+            # so it only takes effect on newly created database files
+            db.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            if DATABASE != ':memory:':
+                # WAL lets readers run alongside the writer; persists in the DB header
+                db.execute("PRAGMA journal_mode=WAL")
+            migrate_schema(db)
+            db.executescript(schema_sql)
+        
+        migrate_legacy_meal_images(db)
         db.commit()
+        release_db(db)
+
 
+# --- SQL STATEMENTS ---
+# Hoisted so every request hands sqlite3 the same string and hits its
+# per-connection statement cache instead of re-parsing and re-planning
+# Live totals for one user and day as one-row tables m and a; binds (user_id, date) twice
+_SQL_DAY_TOTALS = '''
+    (SELECT COALESCE(SUM(calories), 0.0) AS total_cal, COALESCE(SUM(protein), 0.0) AS total_prot,
+            COALESCE(SUM(fat), 0.0) AS total_fat, COALESCE(SUM(carbohydrates), 0.0) AS total_carbs
+     FROM meals 
+     WHERE user_id = ? AND date = ?) AS m
+    CROSS JOIN
+    (SELECT COALESCE(SUM(calories_burned), 0.0) AS total_burned
+     FROM activities 
+     WHERE user_id = ? AND date = ?) AS a
+'''
+SQL_UPSERT_DAILY_SUMMARY = '''
+    INSERT OR REPLACE INTO daily_summary 
+    (user_id, date, total_calories_consumed, total_calories_burned, net_calories,
+     total_protein, total_fat, total_carbs)
+    SELECT ?, ?, m.total_cal, a.total_burned, m.total_cal - a.total_burned,
+           m.total_prot, m.total_fat, m.total_carbs
+    FROM''' + _SQL_DAY_TOTALS
+SQL_INSERT_VITALS = '''
+    INSERT INTO vitals (user_id, date, weight, bmi, body_fat_percentage, 
+                      skeletal_muscle_percentage, fat_free_mass, subcutaneous_fat, 
+                      visceral_fat, body_water_percentage, muscle_mass, bone_mass, 
+                      protein_percentage, bmr, metabolic_age) 
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+SQL_GET_VITALS_IN_RANGE = '''
+    SELECT id, date, weight, bmi, body_fat_percentage, skeletal_muscle_percentage,
+           fat_free_mass, subcutaneous_fat, visceral_fat, body_water_percentage,
+           muscle_mass, bone_mass, protein_percentage, bmr, metabolic_age
+    FROM vitals 
+    WHERE user_id = ? AND date BETWEEN ? AND ?
+    ORDER BY date ASC
+'''
+SQL_GET_MEALS_BY_DATE = '''
+    SELECT id, date, meal_type, food_items, calories, protein, fat,
+           carbohydrates, created_at,
+           CASE WHEN LENGTH(image_data) = 64 THEN image_data END AS image_hash
+    FROM meals 
+    WHERE user_id = ? AND date = ?
+    ORDER BY meal_type_id
+'''
+SQL_GET_MEAL_DATE = 'SELECT date FROM meals WHERE id = ? AND user_id = ?'
+SQL_DELETE_MEAL = 'DELETE FROM meals WHERE id = ? AND user_id = ?'
+SQL_USER_HAS_MEAL_IMAGE = 'SELECT 1 FROM meals WHERE user_id = ? AND image_data = ? LIMIT 1'
+SQL_INSERT_PHOTO_MEAL = '''
+    INSERT INTO meals (user_id, date, meal_type, meal_type_id, food_items, calories, 
+                     protein, fat, carbohydrates, image_data, created_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+SQL_INSERT_MANUAL_MEAL = '''
+    INSERT INTO meals (user_id, date, meal_type, meal_type_id, food_items, calories, 
+                     protein, fat, carbohydrates, created_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+SQL_GET_ACTIVITIES_BY_DATE = '''
+    SELECT id, date, activity_name, duration_minutes, calories_burned, notes, created_at
+    FROM activities 
+    WHERE user_id = ? AND date = ?
+    ORDER BY created_at DESC
+'''
+SQL_INSERT_ACTIVITY = '''
+    INSERT INTO activities (user_id, date, activity_name, duration_minutes, 
+                          calories_burned, notes, created_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+'''
+SQL_GET_ACTIVITY_DATE = 'SELECT date FROM activities WHERE id = ? AND user_id = ?'
+SQL_DELETE_ACTIVITY = 'DELETE FROM activities WHERE id = ? AND user_id = ?'
+# Live per-day totals as correlated scalar subqueries on the me row below
+_SQL_LIVE_MEAL_SUM = '(SELECT COALESCE(SUM({}), 0.0) FROM meals WHERE user_id = me.user_id AND date = me.day)'
+_SQL_LIVE_BURNED = '(SELECT COALESCE(SUM(calories_burned), 0.0) FROM activities WHERE user_id = me.user_id AND date = me.day)'
+# Stored summary joined with the user's target; binds (user_id, date). COALESCE only
+# evaluates the live subqueries when the day has no summary row yet. Always one row
+SQL_GET_DAILY_SUMMARY = f'''
+    SELECT me.day AS date,
+           COALESCE(u.target_calories, 2000) AS target_calories,
+           COALESCE(ds.total_calories_consumed, {_SQL_LIVE_MEAL_SUM.format('calories')}) AS total_calories_consumed,
+           COALESCE(ds.total_calories_burned, {_SQL_LIVE_BURNED}) AS total_calories_burned,
+           COALESCE(ds.net_calories, {_SQL_LIVE_MEAL_SUM.format('calories')} - {_SQL_LIVE_BURNED}) AS net_calories,
+           COALESCE(ds.total_protein, {_SQL_LIVE_MEAL_SUM.format('protein')}) AS total_protein,
+           COALESCE(ds.total_fat, {_SQL_LIVE_MEAL_SUM.format('fat')}) AS total_fat,
+           COALESCE(ds.total_carbs, {_SQL_LIVE_MEAL_SUM.format('carbohydrates')}) AS total_carbs,
+           COALESCE(ds.water_intake_ml, 0.0) AS water_intake_ml,
+           ds.notes
+    FROM (SELECT ? AS user_id, ? AS day) AS me
+    LEFT JOIN users u ON u.id = me.user_id
+    LEFT JOIN daily_summary ds ON ds.user_id = me.user_id AND ds.date = me.day
+'''
+SQL_GET_TARGET_CALORIES = 'SELECT target_calories FROM users WHERE id = ?'
+SQL_GET_MONTH_SUMMARIES = '''
+    SELECT CAST(substr(date, 9, 2) AS INTEGER) AS day, total_calories_consumed, total_calories_burned, net_calories
+    FROM daily_summary 
+    WHERE user_id = ? AND date >= ? AND date < ?
+'''
+
+def tuple_cursor(db):
+    """A cursor yielding plain tuples, for lookups unpacked by position rather than by name"""
+    if DATABASE_URL:
+        return db.cursor(cursor_factory=psycopg2.extensions.cursor)
+    cursor = db.cursor()
+    cursor.row_factory = None
+    return cursor
+
+def stream_json_rows(cursor, db):
+    """
+    Stream the rows of an executed SELECT as a JSON array without building
+    an intermediate list of dicts. One chunk is sent per fetchmany() batch;
+    the connection is released once the last row has been written.
+    """
+    columns = [col[0] for col in cursor.description]
+    if not DATABASE_URL:
+        # Plain tuples skip building a sqlite3.Row per row just to copy it into a dict
+        cursor.row_factory = None
+    cursor.arraysize = 200
+    
+    def generate():
+        try:
+            yield b'['
+            separator = b''
+            while True:
+                rows = cursor.fetchmany()
+                if not rows:
+                    break
+                # RealDictCursor rows are dicts already
+                chunk = b','.join(orjson.dumps(row if DATABASE_URL else dict(zip(columns, row)),
+                                               option=_ORJSON_OPTIONS)
+                                  for row in rows)
+                yield separator + chunk
+                separator = b','
+            yield b']'
+        finally:
+            release_db(db)
+    
+    return app.response_class(stream_with_context(generate()), mimetype='application/json')
 
 # --- EXTERNAL API HELPERS ---
 def allowed_file(filename):
@@ -473,67 +792,134 @@ def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def get_cache_key(data_string):
-    """Generate a cache key from input data"""
-    return hashlib.md5(data_string.encode()).hexdigest()
+_IMAGE_HASH_RE = re.compile(r'^[0-9a-f]{64}$')
+# Stored meal photo extensions and their content types
+MEAL_IMAGE_TYPES = {'jpg': 'image/jpeg', 'png': 'image/png'}
 
-def get_cached_response(cache_key, cache_type='api_cache'):
-    """Check if we have a cached response"""
-    db = get_db()
-    cursor = db.cursor()
-    
-    if DATABASE_URL:
-        cursor.execute(f'''
-            SELECT response_data FROM {cache_type}
-            WHERE cache_key = %s AND expires_at > %s
-        ''', (cache_key, datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
-    else:
-        cursor.execute(f'''
-            SELECT response_data FROM {cache_type}
-            WHERE cache_key = ? AND expires_at > ?
-        ''', (cache_key, datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
-    
-    result = cursor.fetchone()
-    db.close()
+def image_extension(image_bytes):
+    """'png' or 'jpg' from the photo's magic bytes; uploads are limited to those types"""
+    return 'png' if image_bytes.startswith(b'\x89PNG\r\n\x1a\n') else 'jpg'
+
+def meal_image_filename(image_hash):
+    """Name of the stored photo for a hash within UPLOAD_DIR, or None if there is none"""
+    for extension in MEAL_IMAGE_TYPES:
+        filename = f"{image_hash}.{extension}"
+        if os.path.exists(os.path.join(UPLOAD_DIR, filename)):
+            return filename
+    return None
+
+def store_meal_image(image_bytes):
+    """Write a meal photo to UPLOAD_DIR once per distinct content; returns its hash."""
+    image_hash = hashlib.sha256(image_bytes).hexdigest()
+    path = os.path.join(UPLOAD_DIR, f"{image_hash}.{image_extension(image_bytes)}")
+    if not os.path.exists(path):
+        os.makedirs(UPLOAD_DIR, exist_ok=True)
+        # Write to a uniquely named temp file then rename, so a concurrent reader never
+        # sees a partial file and parallel writers (threads or workers) never share one
+        fd, tmp_path = tempfile.mkstemp(dir=UPLOAD_DIR, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(image_bytes)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+    return image_hash
+
+def get_cache_key(data):
+    """Generate a cache key from the full input data (str or bytes)"""
+    if isinstance(data, str):
+        data = data.encode()
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+# In-process L1 in front of api_cache; the database table stays the shared L2
+_api_cache_memory = TTLCache(maxsize=8192, ttl=API_CACHE_MEMORY_TTL)
+_api_cache_memory_lock = threading.Lock()
+
+def get_cached_response_raw(cache_key, cache_type='api_cache', conn=None):
+    """
+    Return the stored JSON text of a cached response without parsing it.
+    Endpoints caching a complete payload can send this straight back as
+    Response(body, mimetype='application/json') instead of decoding and re-encoding.
+    """
+    db = conn if conn is not None else get_db()
+    try:
+        cursor = db.cursor()
+        
+        if DATABASE_URL:
+            cursor.execute(f'''
+                SELECT response_data FROM {cache_type}
+                WHERE cache_key = %s AND expires_at > LOCALTIMESTAMP
+            ''', (cache_key,))
+        else:
+            cursor.execute(f'''
+                SELECT response_data FROM {cache_type}
+                WHERE cache_key = ? AND expires_at > datetime('now', 'localtime')
+            ''', (cache_key,))
+        
+        result = cursor.fetchone()
+    finally:
+        if conn is None:
+            release_db(db)
     if result:
         logging.info(f"Cache hit for key: {cache_key[:8]}...")
-        return json.loads(result['response_data'])
+        return result['response_data']
     return None
 
-def save_to_cache(cache_key, data, hours=24):
-    """Save response to cache"""
-    db = get_db()
-    cursor = db.cursor()
-    
-    expires_at = (datetime.now() + timedelta(hours=hours)).strftime("%Y-%m-%d %H:%M:%S")
-    
-    if DATABASE_URL:
-        cursor.execute('''
-            INSERT INTO api_cache (cache_key, response_data, created_at, expires_at)
-            VALUES (%s, %s, %s, %s)
-            ON CONFLICT (cache_key) DO UPDATE SET
-                response_data = EXCLUDED.response_data,
-                created_at = EXCLUDED.created_at,
-                expires_at = EXCLUDED.expires_at
-        ''', (cache_key, json.dumps(data), datetime.now().strftime("%Y-%m-%d %H:%M:%S"), expires_at))
-    else:
-        cursor.execute('''
-            INSERT OR REPLACE INTO api_cache (cache_key, response_data, created_at, expires_at)
-            VALUES (?, ?, ?, ?)
-        ''', (cache_key, json.dumps(data), datetime.now().strftime("%Y-%m-%d %H:%M:%S"), expires_at))
+def get_cached_response(cache_key, cache_type='api_cache', conn=None):
+    """Check if we have a cached response"""
+    with _api_cache_memory_lock:
+        cached = _api_cache_memory.get((cache_type, cache_key))
+    if cached is not None:
+        logging.info(f"Memory cache hit for key: {cache_key[:8]}...")
+        # Callers get their own copy so they can't alter the shared entry
+        return copy.copy(cached)
     
-    db.commit()
-    db.close()
+    raw = get_cached_response_raw(cache_key, cache_type, conn=conn)
+    if raw is None:
+        return None
+    data = orjson.loads(raw)
+    with _api_cache_memory_lock:
+        _api_cache_memory[(cache_type, cache_key)] = copy.copy(data)
+    return data
+
+def save_to_cache(cache_key, data, hours=24, conn=None):
+    """Save response to cache"""
+    response_data = orjson.dumps(data).decode()
+    db = conn if conn is not None else get_db()
+    try:
+        cursor = db.cursor()
+        
+        # Timestamps are stamped by the database clock
+        if DATABASE_URL:
+            cursor.execute('''
+                INSERT INTO api_cache (cache_key, response_data, created_at, expires_at)
+                VALUES (%s, %s, LOCALTIMESTAMP, LOCALTIMESTAMP + %s * INTERVAL '1 hour')
+                ON CONFLICT (cache_key) DO UPDATE SET
+                    response_data = EXCLUDED.response_data,
+                    created_at = EXCLUDED.created_at,
+                    expires_at = EXCLUDED.expires_at
+            ''', (cache_key, response_data, hours))
+        else:
+            cursor.execute('''
+                INSERT OR REPLACE INTO api_cache (cache_key, response_data, created_at, expires_at)
+                VALUES (?, ?, datetime('now', 'localtime'), datetime('now', 'localtime', ? || ' hours'))
+            ''', (cache_key, response_data, f"{hours:+d}"))
+        
+        db.commit()
+    finally:
+        if conn is None:
+            release_db(db)
+    with _api_cache_memory_lock:
+        _api_cache_memory[('api_cache', cache_key)] = copy.copy(data)
     logging.info(f"Cached response for key: {cache_key[:8]}...")
 
-def analyze_image_with_gemini(image_data_base64):
+def analyze_image_with_gemini(image_bytes):
     """Analyze image with Gemini API - with caching"""
     
     # Check cache first (cache for 7 days for same images)
-    cache_key = get_cache_key(image_data_base64[:100])  # Use first 100 chars for key
-    cached_result = get_cached_response(cache_key)
-    if cached_result:
-        return cached_result
+    # Hash the whole image - images sharing a JPEG header must not share a key
+    cache_key = get_cache_key(image_bytes)
     
     url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-1.5-flash:generateContent?key={GEMINI_API_KEY}"
     headers = {"Content-Type": "application/json"}
@@ -541,13 +927,22 @@ def analyze_image_with_gemini(image_data_base64):
     # More efficient prompt - ask for less verbose response
     prompt = "List only the food items in this image, separated by commas. Be concise. Example: eggs, toast, coffee"
     
-    payload = {"contents": [{"parts": [{"text": prompt}, {"inline_data": {"mime_type": "image/jpeg", "data": image_data_base64}}]}]}
-    
+    # One connection serves both the cache lookup and the cache write
+    db = get_db()
     try:
+        cached_result = get_cached_response(cache_key, conn=db)
+        if cached_result:
+            return cached_result
+        
+        # Only a cache miss pays for base64-encoding the image; the REST API's
+        # inline_data field has no raw-bytes form
+        image_data = base64.b64encode(image_bytes).decode('ascii')
+        payload = {"contents": [{"parts": [{"text": prompt}, {"inline_data": {"mime_type": MEAL_IMAGE_TYPES[image_extension(image_bytes)], "data": image_data}}]}]}
+        
         logging.info("Calling Gemini API...")
-        response = requests.post(url, headers=headers, json=payload)
+        response = _HTTP.post(url, headers=headers, data=orjson.dumps(payload), timeout=HTTP_TIMEOUT)
         response.raise_for_status()
-        result = response.json()
+        result = orjson.loads(response.content)
         
         text_content = result.get('candidates', [{}])[0].get('content', {}).get('parts', [{}])[0].get('text', '')
         if not text_content:
@@ -558,141 +953,248 @@ def analyze_image_with_gemini(image_data_base64):
         food_items = [item.strip() for item in text_content.split(',')]
         
         # Cache the result for 7 days
-        save_to_cache(cache_key, food_items, hours=168)
+        save_to_cache(cache_key, food_items, hours=168, conn=db)
         
         return food_items
 
-    except requests.exceptions.RequestException as e:
+    except (requests.exceptions.RequestException, orjson.JSONDecodeError) as e:
         logging.error(f"Error calling Gemini API: {e}")
         return None
     except (KeyError, IndexError) as e:
         logging.error(f"Error parsing Gemini response: {e} | Response: {result}")
         return None
+    finally:
+        release_db(db)
 
-def get_cached_food_nutrition(food_name):
-    """Get nutrition from local cache"""
-    db = get_db()
-    cursor = db.cursor()
+# Per-100g (calories, protein, fat, carbohydrates) by lowercased food name, None for a
+# known miss; in front of food_cache so repeat foods skip the database
+_food_nutrition_memory = LRUCache(maxsize=4096)
+_food_nutrition_memory_lock = threading.Lock()
+# Bumped on every food_cache write, so a lookup that raced one doesn't memoize stale rows
+_food_nutrition_generation = 0
+
+def set_food_nutrition_memory(entries=None):
+    """Record food_cache writes in the in-process memory; None forgets everything"""
+    global _food_nutrition_generation
+    with _food_nutrition_memory_lock:
+        _food_nutrition_generation += 1
+        if entries is None:
+            _food_nutrition_memory.clear()
+        else:
+            _food_nutrition_memory.update(entries)
+
+def get_cached_food_nutrition_bulk(food_names):
+    """Get cached nutrition for several foods, keyed by lowercased name.
+
+    Names already in the in-process memory are answered from it; the rest
+    share one food_cache query.
+    """
+    names = list(dict.fromkeys(name.lower() for name in food_names))
+    with _food_nutrition_memory_lock:
+        found = {name: _food_nutrition_memory[name] for name in names if name in _food_nutrition_memory}
+        generation = _food_nutrition_generation
+    missing = [name for name in names if name not in found]
     
-    if DATABASE_URL:
-        cursor.execute('''
-            SELECT calories, protein, fat, carbohydrates 
-            FROM food_cache 
-            WHERE LOWER(food_name) = LOWER(%s)
-        ''', (food_name,))
-    else:
-        cursor.execute('''
-            SELECT calories, protein, fat, carbohydrates 
-            FROM food_cache 
-            WHERE LOWER(food_name) = LOWER(?)
-        ''', (food_name,))
+    if missing:
+        placeholder = '%s' if DATABASE_URL else '?'
+        db = get_db()
+        try:
+            cursor = db.cursor()
+            cursor.execute(f'''
+                SELECT food_name, calories, protein, fat, carbohydrates 
+                FROM food_cache 
+                WHERE LOWER(food_name) IN ({', '.join([placeholder] * len(missing))})
+            ''', missing)
+            rows = cursor.fetchall()
+        finally:
+            release_db(db)
+        
+        fetched = dict.fromkeys(missing)  # Unmatched names are remembered as misses
+        for row in rows:
+            fetched[row['food_name'].lower()] = (row['calories'], row['protein'], row['fat'], row['carbohydrates'])
+        with _food_nutrition_memory_lock:
+            if generation == _food_nutrition_generation:
+                _food_nutrition_memory.update(fetched)
+        found.update(fetched)
     
-    result = cursor.fetchone()
-    db.close()
-    if result:
-        logging.info(f"Found cached nutrition for: {food_name}")
-        return {
-            "calories": result['calories'] * 1.5,  # Adjust for serving size
-            "protein": result['protein'] * 1.5,
-            "fat": result['fat'] * 1.5,
-            "carbohydrates": result['carbohydrates'] * 1.5
+    return {
+        name: {
+            "calories": base[0] * 1.5,  # Adjust for serving size
+            "protein": base[1] * 1.5,
+            "fat": base[2] * 1.5,
+            "carbohydrates": base[3] * 1.5
         }
-    return None
+        for name, base in found.items() if base is not None
+    }
 
-def save_food_to_cache(food_name, nutrition):
-    """Save food nutrition to cache"""
-    db = get_db()
-    cursor = db.cursor()
+def save_food_to_cache_bulk(foods):
+    """Save several {food_name: nutrition} entries to the cache in one statement"""
+    if not foods:
+        return
     
     # Save base values (per 100g)
-    if DATABASE_URL:
-        cursor.execute('''
-            INSERT INTO food_cache 
-            (food_name, calories, protein, fat, carbohydrates, last_updated)
-            VALUES (%s, %s, %s, %s, %s, %s)
-            ON CONFLICT (food_name) DO UPDATE SET
-                calories = EXCLUDED.calories,
-                protein = EXCLUDED.protein,
-                fat = EXCLUDED.fat,
-                carbohydrates = EXCLUDED.carbohydrates,
-                last_updated = EXCLUDED.last_updated
-        ''', (food_name, 
-              nutrition['calories'] / 1.5,  # Store per 100g
-              nutrition['protein'] / 1.5,
-              nutrition['fat'] / 1.5,
-              nutrition['carbohydrates'] / 1.5,
-              datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
-    else:
-        cursor.execute('''
-            INSERT OR REPLACE INTO food_cache 
-            (food_name, calories, protein, fat, carbohydrates, last_updated)
-            VALUES (?, ?, ?, ?, ?, ?)
-        ''', (food_name, 
-              nutrition['calories'] / 1.5,  # Store per 100g
-              nutrition['protein'] / 1.5,
-              nutrition['fat'] / 1.5,
-              nutrition['carbohydrates'] / 1.5,
-              datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+    rows = [(food_name,
+             nutrition['calories'] / 1.5,
+             nutrition['protein'] / 1.5,
+             nutrition['fat'] / 1.5,
+             nutrition['carbohydrates'] / 1.5)
+            for food_name, nutrition in foods.items()]
     
-    db.commit()
-    db.close()
+    db = get_db()
+    try:
+        cursor = db.cursor()
+        if DATABASE_URL:
+            execute_values(cursor, '''
+                INSERT INTO food_cache 
+                (food_name, calories, protein, fat, carbohydrates, last_updated)
+                VALUES %s
+                ON CONFLICT (food_name) DO UPDATE SET
+                    calories = EXCLUDED.calories,
+                    protein = EXCLUDED.protein,
+                    fat = EXCLUDED.fat,
+                    carbohydrates = EXCLUDED.carbohydrates,
+                    last_updated = EXCLUDED.last_updated
+            ''', rows, template='(%s, %s, %s, %s, %s, LOCALTIMESTAMP)')
+        else:
+            cursor.executemany('''
+                INSERT OR REPLACE INTO food_cache 
+                (food_name, calories, protein, fat, carbohydrates, last_updated)
+                VALUES (?, ?, ?, ?, ?, datetime('now', 'localtime'))
+            ''', rows)
+        db.commit()
+    finally:
+        release_db(db)
+    set_food_nutrition_memory({row[0].lower(): row[1:] for row in rows})
 
-def get_nutrition_from_fatsecret(food_item):
+def purge_expired_cache():
+    """Delete expired api_cache rows and stale food_cache rows in one pass"""
+    db = get_db()
+    try:
+        cursor = db.cursor()
+        if DATABASE_URL:
+            cursor.execute("DELETE FROM api_cache WHERE expires_at < LOCALTIMESTAMP")
+            cursor.execute("DELETE FROM food_cache WHERE last_updated < LOCALTIMESTAMP - %s * INTERVAL '1 day'",
+                           (FOOD_CACHE_MAX_AGE_DAYS,))
+            db.commit()
+            # Autovacuum reclaims the space; refresh planner stats right away
+            cursor.execute("ANALYZE api_cache")
+            db.commit()
+        else:
+            cursor.execute("DELETE FROM api_cache WHERE expires_at < datetime('now', 'localtime')")
+            cursor.execute("DELETE FROM food_cache WHERE last_updated < datetime('now', 'localtime', ?)",
+                           (f"-{FOOD_CACHE_MAX_AGE_DAYS} days",))
+            db.commit()
+            # execute() steps the pragma once, freeing a single page; executescript runs it to completion
+            db.executescript("PRAGMA incremental_vacuum(100);")
+    finally:
+        release_db(db)
+    set_food_nutrition_memory()
+
+def get_nutritions_bulk(food_items):
     """
-    Get nutrition with caching to minimize API calls
+    Get nutrition for every item of a meal, returned in the same order.
+    One cache query covers all items; only misses fall through to estimates,
+    and the remaining FatSecret lookups run concurrently.
     """
-    # First check local cache
-    cached_nutrition = get_cached_food_nutrition(food_item)
-    if cached_nutrition:
-        return cached_nutrition
+    cached = get_cached_food_nutrition_bulk(food_items)
+    to_cache = {}
+    results = []
+    misses = []
+    for index, item in enumerate(food_items):
+        nutrition = cached.get(item.lower())
+        if nutrition:
+            logging.info(f"Found cached nutrition for: {item}")
+        else:
+            nutrition = estimate_nutrition(item)
+            if nutrition:
+                to_cache[item] = nutrition
+                cached[item.lower()] = nutrition
+            else:
+                misses.append(index)
+        results.append(nutrition)
     
-    # Built-in nutrition database (per 100g serving)
-    NUTRITION_ESTIMATES = {
-        'chicken': {"calories": 165, "protein": 31, "fat": 3.6, "carbohydrates": 0},
-        'potato': {"calories": 77, "protein": 2, "fat": 0.1, "carbohydrates": 17},
-        'green beans': {"calories": 31, "protein": 1.8, "fat": 0.2, "carbohydrates": 7},
-        'butternut squash': {"calories": 45, "protein": 1, "fat": 0.1, "carbohydrates": 12},
-        'rice': {"calories": 130, "protein": 2.7, "fat": 0.3, "carbohydrates": 28},
-        'bread': {"calories": 265, "protein": 9, "fat": 3.2, "carbohydrates": 49},
-        'egg': {"calories": 155, "protein": 13, "fat": 11, "carbohydrates": 1.1},
-        'salmon': {"calories": 208, "protein": 20, "fat": 13, "carbohydrates": 0},
-        'beef': {"calories": 250, "protein": 26, "fat": 15, "carbohydrates": 0},
-        'pasta': {"calories": 131, "protein": 5, "fat": 1.1, "carbohydrates": 25},
-        'apple': {"calories": 52, "protein": 0.3, "fat": 0.2, "carbohydrates": 14},
-        'banana': {"calories": 89, "protein": 1.1, "fat": 0.3, "carbohydrates": 23},
-        'broccoli': {"calories": 34, "protein": 2.8, "fat": 0.4, "carbohydrates": 7},
-        'carrot': {"calories": 41, "protein": 0.9, "fat": 0.2, "carbohydrates": 10},
-        'cheese': {"calories": 402, "protein": 25, "fat": 33, "carbohydrates": 1.3},
-        'milk': {"calories": 42, "protein": 3.4, "fat": 1, "carbohydrates": 5},
-        'yogurt': {"calories": 59, "protein": 10, "fat": 0.4, "carbohydrates": 3.6},
-        'avocado': {"calories": 160, "protein": 2, "fat": 15, "carbohydrates": 9},
-        'tomato': {"calories": 18, "protein": 0.9, "fat": 0.2, "carbohydrates": 3.9},
-        'lettuce': {"calories": 15, "protein": 1.4, "fat": 0.2, "carbohydrates": 2.9}
-    }
+    if misses:
+        fetched = _NUTRITION_POOL.map(fetch_fatsecret_nutrition, [food_items[i] for i in misses])
+        for index, nutrition in zip(misses, fetched):
+            results[index] = nutrition
     
+    # Save new estimates to cache for future use
+    save_food_to_cache_bulk(to_cache)
+    return results
+
+NUTRIENT_KEYS = ('calories', 'protein', 'fat', 'carbohydrates')
+
+# Built-in nutrition database (per 100g serving)
+NUTRITION_ESTIMATES = {
+    'chicken': {"calories": 165, "protein": 31, "fat": 3.6, "carbohydrates": 0},
+    'potato': {"calories": 77, "protein": 2, "fat": 0.1, "carbohydrates": 17},
+    'green beans': {"calories": 31, "protein": 1.8, "fat": 0.2, "carbohydrates": 7},
+    'butternut squash': {"calories": 45, "protein": 1, "fat": 0.1, "carbohydrates": 12},
+    'rice': {"calories": 130, "protein": 2.7, "fat": 0.3, "carbohydrates": 28},
+    'bread': {"calories": 265, "protein": 9, "fat": 3.2, "carbohydrates": 49},
+    'egg': {"calories": 155, "protein": 13, "fat": 11, "carbohydrates": 1.1},
+    'salmon': {"calories": 208, "protein": 20, "fat": 13, "carbohydrates": 0},
+    'beef': {"calories": 250, "protein": 26, "fat": 15, "carbohydrates": 0},
+    'pasta': {"calories": 131, "protein": 5, "fat": 1.1, "carbohydrates": 25},
+    'apple': {"calories": 52, "protein": 0.3, "fat": 0.2, "carbohydrates": 14},
+    'banana': {"calories": 89, "protein": 1.1, "fat": 0.3, "carbohydrates": 23},
+    'broccoli': {"calories": 34, "protein": 2.8, "fat": 0.4, "carbohydrates": 7},
+    'carrot': {"calories": 41, "protein": 0.9, "fat": 0.2, "carbohydrates": 10},
+    'cheese': {"calories": 402, "protein": 25, "fat": 33, "carbohydrates": 1.3},
+    'milk': {"calories": 42, "protein": 3.4, "fat": 1, "carbohydrates": 5},
+    'yogurt': {"calories": 59, "protein": 10, "fat": 0.4, "carbohydrates": 3.6},
+    'avocado': {"calories": 160, "protein": 2, "fat": 15, "carbohydrates": 9},
+    'tomato': {"calories": 18, "protein": 0.9, "fat": 0.2, "carbohydrates": 3.9},
+    'lettuce': {"calories": 15, "protein": 1.4, "fat": 0.2, "carbohydrates": 2.9}
+}
+
+@lru_cache(maxsize=1024)
+def _match_estimate(food_lower):
+    """Key of the first NUTRITION_ESTIMATES entry matching a normalized food name"""
+    for key in NUTRITION_ESTIMATES:
+        if key in food_lower or food_lower in key:
+            return key
+    return None
+
+def estimate_nutrition(food_item):
+    """Match a food against the built-in estimates (scaled to a ~150g serving)"""
     # Try to match food item with estimates
     food_lower = food_item.lower().strip().rstrip('.')
+    key = _match_estimate(food_lower)
+    if key is None:
+        return None
     
-    # First try exact match
-    for key, nutrition in NUTRITION_ESTIMATES.items():
-        if key in food_lower or food_lower in key:
-            logging.info(f"Using estimated nutrition for '{food_item}' (matched with '{key}')")
-            # Adjust for typical serving size (assuming ~150g average serving)
-            result = {
-                "calories": nutrition["calories"] * 1.5,
-                "protein": nutrition["protein"] * 1.5,
-                "fat": nutrition["fat"] * 1.5,
-                "carbohydrates": nutrition["carbohydrates"] * 1.5
-            }
-            # Save to cache for future use
-            save_food_to_cache(food_item, result)
-            return result
-    
+    nutrition = NUTRITION_ESTIMATES[key]
+    logging.info(f"Using estimated nutrition for '{food_item}' (matched with '{key}')")
+    # Adjust for typical serving size (assuming ~150g average serving)
+    return {
+        "calories": nutrition["calories"] * 1.5,
+        "protein": nutrition["protein"] * 1.5,
+        "fat": nutrition["fat"] * 1.5,
+        "carbohydrates": nutrition["carbohydrates"] * 1.5
+    }
+
+# FatSecret food_description, e.g. "Per 100g - Calories: 165kcal | Fat: 3.57g | Carbs: 0.00g | Protein: 31.02g"
+_FATSECRET_NUTRITION_RE = re.compile(
+    r'Calories:\s*([\d.]+)kcal.*?Fat:\s*([\d.]+)g.*?Carbs:\s*([\d.]+)g.*?Protein:\s*([\d.]+)g'
+)
+
+# Successful FatSecret lookups, so repeat foods skip the API; fallbacks are never memoised
+_fatsecret_memory = TTLCache(maxsize=4096, ttl=API_CACHE_MEMORY_TTL)
+_fatsecret_memory_lock = threading.Lock()
+
+def fetch_fatsecret_nutrition(food_item):
+    """Look up a food on the FatSecret API, falling back to generic values"""
     if not FATSECRET_ACCESS_TOKEN:
         logging.warning(f"No nutrition estimate found for '{food_item}' and FatSecret token not configured")
         # Return generic values for unknown foods
         return {"calories": 100, "protein": 5, "fat": 3, "carbohydrates": 15}
 
+    with _fatsecret_memory_lock:
+        memoised = _fatsecret_memory.get(food_item)
+    if memoised:
+        return dict(memoised)
+
     # Try FatSecret API if token is available
     url = "https://platform.fatsecret.com/rest/server.api"
     params = {
@@ -704,12 +1206,12 @@ def get_nutrition_from_fatsecret(food_item):
     
     try:
         logging.info(f"Calling FatSecret API for '{food_item}'...")
-        response = requests.get(url, headers=headers, params=params)
+        response = _HTTP.get(url, headers=headers, params=params, timeout=HTTP_TIMEOUT)
         response.raise_for_status()
-        data = response.json()
+        data = orjson.loads(response.content)
         
-        # Log the response for debugging
-        logging.debug(f"FatSecret response for '{food_item}': {data}")
+        # Log the response for debugging (formatted only when DEBUG is on)
+        logging.debug("FatSecret response for '%s': %s", food_item, data)
         
         # Check if we got an error response
         if 'error' in data:
@@ -743,38 +1245,15 @@ def get_nutrition_from_fatsecret(food_item):
         # Parse nutrition from description
         # Format: "Per 100g - Calories: 165kcal | Fat: 3.57g | Carbs: 0.00g | Protein: 31.02g"
         nutrition = {"calories": 0, "protein": 0, "fat": 0, "carbohydrates": 0}
-        
-        parts = description.split('|')
-        for part in parts:
-            part = part.strip()
-            if 'Calories:' in part:
-                try:
-                    cal_str = part.split(':')[1].strip()
-                    nutrition['calories'] = float(cal_str.replace('kcal', ''))
-                except:
-                    pass
-            elif 'Fat:' in part:
-                try:
-                    fat_str = part.split(':')[1].strip()
-                    nutrition['fat'] = float(fat_str.replace('g', ''))
-                except:
-                    pass
-            elif 'Carbs:' in part:
-                try:
-                    carb_str = part.split(':')[1].strip()
-                    nutrition['carbohydrates'] = float(carb_str.replace('g', ''))
-                except:
-                    pass
-            elif 'Protein:' in part:
-                try:
-                    prot_str = part.split(':')[1].strip()
-                    nutrition['protein'] = float(prot_str.replace('g', ''))
-                except:
-                    pass
+        match = _FATSECRET_NUTRITION_RE.search(description)
+        if match:
+            nutrition = dict(zip(('calories', 'fat', 'carbohydrates', 'protein'), map(float, match.groups())))
         
         # If we got valid nutrition data, return it
         if any(v > 0 for v in nutrition.values()):
             logging.info(f"Successfully parsed FatSecret nutrition for '{food_item}': {nutrition}")
+            with _fatsecret_memory_lock:
+                _fatsecret_memory[food_item] = dict(nutrition)
             return nutrition
         else:
             logging.warning(f"Could not parse nutrition from FatSecret for '{food_item}'")
@@ -789,54 +1268,41 @@ def get_nutrition_from_fatsecret(food_item):
 
 # --- AUTHENTICATION HELPERS ---
 def login_required(f):
+    """Redirect page requests without a session to the login page (API routes use require_api_login)"""
     @wraps(f)
     def decorated_function(*args, **kwargs):
         if 'user_id' not in session:
-            # Check if it's an API request or a page request
-            if request.path.startswith('/api/'):
-                return jsonify({"status": "error", "message": "Login required"}), 401
-            else:
-                return redirect(url_for('login_page'))
+            return redirect(url_for('login_page'))
         return f(*args, **kwargs)
     return decorated_function
 
-def update_daily_summary(user_id, date_str):
-    """Update daily summary with totals from meals and activities"""
-    db = get_db()
-    cursor = db.cursor()
-    
-    # Get total calories consumed
-    cursor.execute('''
-        SELECT SUM(calories) as total_cal, SUM(protein) as total_prot, 
-               SUM(fat) as total_fat, SUM(carbohydrates) as total_carbs
-        FROM meals 
-        WHERE user_id = ? AND date = ?
-    ''', (user_id, date_str))
-    meal_totals = cursor.fetchone()
-    
-    # Get total calories burned
-    cursor.execute('''
-        SELECT SUM(calories_burned) as total_burned
-        FROM activities 
-        WHERE user_id = ? AND date = ?
-    ''', (user_id, date_str))
-    activity_totals = cursor.fetchone()
-    
-    total_consumed = meal_totals['total_cal'] or 0
-    total_burned = activity_totals['total_burned'] or 0
-    net_calories = total_consumed - total_burned
+def regenerate_session():
+    """Empty the session and move it to a fresh id, so an id planted before login is worthless"""
+    interface = app.session_interface
+    stale_key = interface.key_prefix + session.sid
+    if REDIS_URL:
+        interface.redis.delete(stale_key)
+    else:
+        interface.cache.delete(stale_key)
+    session.clear()
+    # Same generator and length Flask-Session uses for new sessions
+    session.sid = secrets.token_urlsafe(app.config.get('SESSION_ID_LENGTH', 32))
+
+def update_daily_summary(user_id, date_str, cursor=None, commit=True):
+    """Update daily summary with totals from meals and activities.
+
+    Pass the caller's cursor and commit=False to fold the refresh into the
+    caller's write transaction.
+    """
+    if cursor is None:
+        cursor = get_db().cursor()
     
-    # Update or insert daily summary
-    cursor.execute('''
-        INSERT OR REPLACE INTO daily_summary 
-        (user_id, date, total_calories_consumed, total_calories_burned, net_calories,
-         total_protein, total_fat, total_carbs)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-    ''', (user_id, date_str, total_consumed, total_burned, net_calories,
-          meal_totals['total_prot'] or 0, meal_totals['total_fat'] or 0, 
-          meal_totals['total_carbs'] or 0))
+    # Aggregate meals and activities and upsert the summary in one statement
+    cursor.execute(SQL_UPSERT_DAILY_SUMMARY,
+                   (user_id, date_str, user_id, date_str, user_id, date_str))
     
-    db.commit()
+    if commit:
+        cursor.connection.commit()
 
 # --- API ENDPOINTS ---
 @app.route('/')
@@ -850,13 +1316,25 @@ def login_page():
     return render_template('login.html')
 
 @app.route('/dashboard')
+@login_required
 def dashboard():
-    if 'user_id' not in session:
-        return redirect(url_for('login_page'))
     return render_template('dashboard.html')
 
+# Every /api route lives on this blueprint; its before_request hook answers
+# unauthenticated calls with a JSON 401 instead of a login redirect
+api = Blueprint('api', __name__, url_prefix='/api')
+API_PUBLIC_ENDPOINTS = {'api.signup', 'api.login', 'api.logout'}
+
+@api.before_request
+def require_api_login():
+    if 'user_id' not in session and request.endpoint not in API_PUBLIC_ENDPOINTS:
+        return jsonify({"status": "error", "message": "Login required"}), 401
+
 # --- AUTHENTICATION ENDPOINTS ---
-@app.route('/api/signup', methods=['POST'])
+_USERNAME_RE = re.compile(r'\A[A-Za-z0-9_]{3,32}\Z')
+_EMAIL_RE = re.compile(r'\A[^@\s]+@[^@\s]+\.[^@\s]+\Z')
+
+@api.route('/signup', methods=['POST'])
 def signup():
     try:
         data = request.json
@@ -869,16 +1347,16 @@ def signup():
         if not username or not password:
             return jsonify({"status": "error", "message": "Username and password are required"}), 400
         
-        if len(username) < 3:
-            return jsonify({"status": "error", "message": "Username must be at least 3 characters"}), 400
+        # Length and character set in one match; the length is only re-checked to pick the message
+        if not _USERNAME_RE.match(username):
+            if not 3 <= len(username) <= 32:
+                return jsonify({"status": "error", "message": "Username must be 3-32 characters"}), 400
+            return jsonify({"status": "error", "message": "Username can only contain letters, numbers, and underscores"}), 400
         
         if len(password) < 6:
             return jsonify({"status": "error", "message": "Password must be at least 6 characters"}), 400
         
-        if not username.replace('_', '').isalnum():
-            return jsonify({"status": "error", "message": "Username can only contain letters, numbers, and underscores"}), 400
-        
-        if email and '@' not in email:
+        if email and not _EMAIL_RE.match(email):
             return jsonify({"status": "error", "message": "Invalid email format"}), 400
         
         db = get_db()
@@ -893,12 +1371,12 @@ def signup():
                           (username, email, ''))
         
         if cursor.fetchone():
-            db.close()
+            release_db(db)
             return jsonify({"status": "error", "message": "Username or email already exists"}), 400
         
         # Create user
         password_hash = generate_password_hash(password)
-        created_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        created_at = datetime.now().isoformat(' ', 'seconds')
         
         if DATABASE_URL:
             cursor.execute('''
@@ -914,9 +1392,10 @@ def signup():
             user_id = cursor.lastrowid
         
         db.commit()
-        db.close()
+        release_db(db)
         
         # Auto-login after signup
+        regenerate_session()
         session['user_id'] = user_id
         session['username'] = username
         session.permanent = True  # Make session permanent on signup
@@ -927,10 +1406,10 @@ def signup():
     except Exception as e:
         logging.error(f"Signup error: {e}")
         if db:
-            db.close()
+            release_db(db)
         return jsonify({"status": "error", "message": f"Signup failed: {str(e)}"}), 500
 
-@app.route('/api/login', methods=['POST'])
+@api.route('/login', methods=['POST'])
 def login():
     try:
         data = request.json
@@ -942,7 +1421,7 @@ def login():
             return jsonify({"status": "error", "message": "Username and password are required"}), 400
         
         db = get_db()
-        cursor = db.cursor()
+        cursor = tuple_cursor(db)
         
         # Use correct placeholder for database type
         if DATABASE_URL:
@@ -951,17 +1430,23 @@ def login():
             cursor.execute('SELECT id, password_hash FROM users WHERE username = ?', (username,))
         
         user = cursor.fetchone()
-        db.close()
+        release_db(db)
+        user_id, password_hash = user if user else (None, DUMMY_HASH)
+        
+        # Always run one hash verification so response time doesn't reveal
+        # whether the username exists
+        password_ok = check_password_hash(password_hash, password)
         
         if not user:
             logging.warning(f"User not found: {username}")
             return jsonify({"status": "error", "message": "Invalid username or password"}), 401
             
-        if not check_password_hash(user['password_hash'], password):
+        if not password_ok:
             logging.warning(f"Invalid password for username: {username}")
             return jsonify({"status": "error", "message": "Invalid username or password"}), 401
         
-        session['user_id'] = user['id']
+        regenerate_session()
+        session['user_id'] = user_id
         session['username'] = username
         
         # Make session permanent if "remember me" is checked
@@ -970,22 +1455,21 @@ def login():
         else:
             session.permanent = False
         
-        logging.info(f"User logged in: {username} (ID: {user['id']})")
+        logging.info(f"User logged in: {username} (ID: {user_id})")
         return jsonify({"status": "success", "message": "Logged in successfully"}), 200
         
     except Exception as e:
         logging.error(f"Login error: {e}")
         if db:
-            db.close()
+            release_db(db)
         return jsonify({"status": "error", "message": f"Login failed: {str(e)}"}), 500
 
-@app.route('/api/logout', methods=['POST'])
+@api.route('/logout', methods=['POST'])
 def logout():
     session.clear()
     return jsonify({"status": "success", "message": "Logged out successfully"}), 200
 
-@app.route('/api/user/profile', methods=['GET', 'PUT'])
-@login_required
+@api.route('/user/profile', methods=['GET', 'PUT'])
 def user_profile():
     try:
         user_id = session['user_id']
@@ -1043,88 +1527,59 @@ def user_profile():
         return jsonify({"status": "error", "message": "Failed to update profile"}), 500
 
 # --- VITALS ENDPOINTS ---
-@app.route('/api/vitals', methods=['POST', 'GET'])
-@login_required
+@api.route('/vitals', methods=['POST', 'GET'])
 def vitals_route():
     user_id = session['user_id']
     db = get_db()
+    today = date.today()
     if request.method == 'POST':
         data = request.json
-        date_str = data.get('date', datetime.now().strftime("%Y-%m-%d"))
+        # Stored as ISO-8601 so "latest weight" ordering can walk idx_vitals_user_date
+        try:
+            date_str = date.fromisoformat(data.get('date') or today.isoformat()).isoformat()
+        except (ValueError, TypeError):
+            return jsonify({"status": "error", "message": "Invalid date (expected YYYY-MM-DD)"}), 400
         cursor = db.cursor()
         
-        cursor.execute('''
-            INSERT INTO vitals (user_id, date, weight, bmi, body_fat_percentage, 
-                              skeletal_muscle_percentage, fat_free_mass, subcutaneous_fat, 
-                              visceral_fat, body_water_percentage, muscle_mass, bone_mass, 
-                              protein_percentage, bmr, metabolic_age) 
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (user_id, date_str, data.get('weight'), data.get('bmi'), 
-              data.get('body_fat_percentage'), data.get('skeletal_muscle_percentage'),
-              data.get('fat_free_mass'), data.get('subcutaneous_fat'), 
-              data.get('visceral_fat'), data.get('body_water_percentage'),
-              data.get('muscle_mass'), data.get('bone_mass'), 
-              data.get('protein_percentage'), data.get('bmr'), data.get('metabolic_age')))
-        
-        db.commit()
+        with db:
+            cursor.execute(SQL_INSERT_VITALS, (user_id, date_str, data.get('weight'), data.get('bmi'), 
+                  data.get('body_fat_percentage'), data.get('skeletal_muscle_percentage'),
+                  data.get('fat_free_mass'), data.get('subcutaneous_fat'), 
+                  data.get('visceral_fat'), data.get('body_water_percentage'),
+                  data.get('muscle_mass'), data.get('bone_mass'), 
+                  data.get('protein_percentage'), data.get('bmr'), data.get('metabolic_age')))
         logging.info(f"New vitals entry added for user {user_id}")
         return jsonify({"status": "success", "message": "Vitals added successfully!"}), 201
     
     else:  # GET
-        date_from = request.args.get('from', (datetime.now() - timedelta(days=30)).strftime("%Y-%m-%d"))
-        date_to = request.args.get('to', datetime.now().strftime("%Y-%m-%d"))
+        date_from = request.args.get('from') or (today - timedelta(days=30)).isoformat()
+        date_to = request.args.get('to') or today.isoformat()
         
         cursor = db.cursor()
-        cursor.execute('''
-            SELECT * FROM vitals 
-            WHERE user_id = ? AND date BETWEEN ? AND ?
-            ORDER BY date ASC
-        ''', (user_id, date_from, date_to))
+        cursor.execute(SQL_GET_VITALS_IN_RANGE, (user_id, date_from, date_to))
         
-        vitals = [dict(row) for row in cursor.fetchall()]
-        return jsonify(vitals)
+        return stream_json_rows(cursor, db)
 
 # --- MEAL ENDPOINTS ---
-@app.route('/api/meal', methods=['POST', 'GET', 'DELETE'])
-@login_required
+@api.route('/meal', methods=['POST', 'GET', 'DELETE'])
 def meal_route():
     user_id = session['user_id']
     db = get_db()
+    # One clock read per request, shared by the date default and created_at
+    now = datetime.now()
     
     if request.method == 'GET':
         # Get meals for a specific date or date range
-        date_str = request.args.get('date', datetime.now().strftime("%Y-%m-%d"))
+        date_str = request.args.get('date') or now.date().isoformat()
         cursor = db.cursor()
         
         # Use proper placeholder for database type
         if DATABASE_URL:
-            cursor.execute('''
-                SELECT * FROM meals 
-                WHERE user_id = %s AND date = %s
-                ORDER BY 
-                    CASE meal_type 
-                        WHEN 'breakfast' THEN 1 
-                        WHEN 'lunch' THEN 2 
-                        WHEN 'snacks' THEN 3 
-                        WHEN 'dinner' THEN 4 
-                    END
-            ''', (user_id, date_str))
+            cursor.execute(_translate_query_for_postgres(SQL_GET_MEALS_BY_DATE), (user_id, date_str))
         else:
-            cursor.execute('''
-                SELECT * FROM meals 
-                WHERE user_id = ? AND date = ?
-                ORDER BY 
-                    CASE meal_type 
-                        WHEN 'breakfast' THEN 1 
-                        WHEN 'lunch' THEN 2 
-                        WHEN 'snacks' THEN 3 
-                        WHEN 'dinner' THEN 4 
-                    END
-            ''', (user_id, date_str))
-        
-        meals = [dict(row) for row in cursor.fetchall()]
-        db.close()
-        return jsonify(meals)
+            cursor.execute(SQL_GET_MEALS_BY_DATE, (user_id, date_str))
+        
+        return stream_json_rows(cursor, db)
     
     elif request.method == 'DELETE':
         # Delete a meal
@@ -1133,54 +1588,71 @@ def meal_route():
         if not meal_id:
             return jsonify({"status": "error", "message": "Meal ID required"}), 400
         
-        cursor = db.cursor()
+        cursor = tuple_cursor(db)
         
         # Get date before deleting for summary update
         if DATABASE_URL:
-            cursor.execute('SELECT date FROM meals WHERE id = %s AND user_id = %s', 
-                          (meal_id, user_id))
+            cursor.execute(_translate_query_for_postgres(SQL_GET_MEAL_DATE), (meal_id, user_id))
         else:
-            cursor.execute('SELECT date FROM meals WHERE id = ? AND user_id = ?', 
-                          (meal_id, user_id))
+            cursor.execute(SQL_GET_MEAL_DATE, (meal_id, user_id))
         
         meal = cursor.fetchone()
         
         if meal:
-            date_str = meal['date']
-            
-            # Delete the meal
-            if DATABASE_URL:
-                cursor.execute('DELETE FROM meals WHERE id = %s AND user_id = %s', 
-                             (meal_id, user_id))
-            else:
-                cursor.execute('DELETE FROM meals WHERE id = ? AND user_id = ?', 
-                             (meal_id, user_id))
-            
-            db.commit()
-            db.close()
+            (date_str,) = meal
             
-            # Update daily summary
-            update_daily_summary(user_id, date_str)
+            # Delete the meal and refresh the daily summary in one transaction
+            with db:
+                if DATABASE_URL:
+                    cursor.execute(_translate_query_for_postgres(SQL_DELETE_MEAL), (meal_id, user_id))
+                else:
+                    cursor.execute(SQL_DELETE_MEAL, (meal_id, user_id))
+                update_daily_summary(user_id, date_str, cursor=cursor, commit=False)
+            release_db(db)
             
             logging.info(f"Meal {meal_id} deleted for user {user_id}")
             return jsonify({"status": "success", "message": "Meal deleted"}), 200
         
-        db.close()
+        release_db(db)
         return jsonify({"status": "error", "message": "Meal not found"}), 404
     
     else:  # POST - Add new meal
         meal_type = request.form.get('meal_type', 'snacks')
-        date_str = request.form.get('date', datetime.now().strftime("%Y-%m-%d"))
+        date_str = request.form.get('date') or now.date().isoformat()
         
         # Check if photo is provided for analysis
         if 'photo' in request.files and request.files['photo'].filename:
-            return analyze_meal_with_photo(user_id, meal_type, date_str)
+            return analyze_meal_with_photo(user_id, meal_type, date_str, now)
         else:
             # Manual entry
             data = request.get_json() if request.is_json else request.form
-            return add_manual_meal(user_id, data, date_str)
+            return add_manual_meal(user_id, data, date_str, now)
+
+@api.route('/meal/image/<image_hash>')
+def meal_image(image_hash):
+    """Serve a stored meal photo to the user who logged it"""
+    if not _IMAGE_HASH_RE.match(image_hash):
+        return jsonify({"status": "error", "message": "Image not found"}), 404
+    
+    db = get_db()
+    cursor = db.cursor()
+    if DATABASE_URL:
+        cursor.execute(_translate_query_for_postgres(SQL_USER_HAS_MEAL_IMAGE), (session['user_id'], image_hash))
+    else:
+        cursor.execute(SQL_USER_HAS_MEAL_IMAGE, (session['user_id'], image_hash))
+    owned = cursor.fetchone()
+    release_db(db)
+    
+    filename = meal_image_filename(image_hash) if owned else None
+    if not filename:
+        return jsonify({"status": "error", "message": "Image not found"}), 404
+    response = send_from_directory(UPLOAD_DIR, filename, max_age=MEAL_IMAGE_MAX_AGE)
+    # Per-user content: cacheable by the browser, not by shared proxies
+    response.cache_control.public = False
+    response.cache_control.private = True
+    return response
 
-def analyze_meal_with_photo(user_id, meal_type, date_str):
+def analyze_meal_with_photo(user_id, meal_type, date_str, now):
     """Analyze meal from photo and save to database"""
     logging.info(f"Analyzing meal photo for user {user_id}, meal type: {meal_type}")
     
@@ -1202,80 +1674,59 @@ def analyze_meal_with_photo(user_id, meal_type, date_str):
     
     try:
         image_bytes = photo.read()
-        image_base64 = base64.b64encode(image_bytes).decode('utf-8')
         
-        food_items = analyze_image_with_gemini(image_base64)
+        food_items = analyze_image_with_gemini(image_bytes)
         if food_items is None:
             return jsonify({"status": "error", "message": "Could not analyze image with AI. Check server logs."}), 500
         if not food_items:
             return jsonify({"status": "error", "message": "AI could not identify any food in the image."}), 400
 
-        total_nutrition = {"calories": 0, "protein": 0, "fat": 0, "carbohydrates": 0}
         nutrition_breakdown = []  # Store individual item nutrition for logging
         
         # Apply user-selected portion multiplier instead of fixed 1.5
-        for item in food_items:
-            base_nutrition = get_nutrition_from_fatsecret(item)
+        # Note: base nutrition already has 1.5x multiplier, so we adjust from there
+        adjustment_factor = portion_multiplier / 1.5
+        # Look each distinct food up once; repeats scale its nutrition by their count
+        counts = Counter(food_items)
+        for (item, count), base_nutrition in zip(counts.items(), get_nutritions_bulk(list(counts))):
             if base_nutrition:
-                # Adjust nutrition based on user-selected portion size
-                # Note: base_nutrition already has 1.5x multiplier, so we adjust from there
-                adjustment_factor = portion_multiplier / 1.5
-                adjusted_nutrition = {
-                    "calories": base_nutrition["calories"] * adjustment_factor,
-                    "protein": base_nutrition["protein"] * adjustment_factor,
-                    "fat": base_nutrition["fat"] * adjustment_factor,
-                    "carbohydrates": base_nutrition["carbohydrates"] * adjustment_factor
-                }
-                
+                factor = adjustment_factor * count
                 nutrition_breakdown.append({
                     "food": item,
-                    "nutrition": adjusted_nutrition,
+                    "count": count,
+                    "nutrition": {key: base_nutrition[key] * factor for key in NUTRIENT_KEYS},
                     "portion_grams": portion_multiplier * 100  # Convert to grams for display
                 })
-                
-                for key in total_nutrition:
-                    total_nutrition[key] += adjusted_nutrition[key]
-        
-        # Log detailed breakdown with portion sizes
-        logging.info("=" * 60)
-        logging.info("MEAL NUTRITION BREAKDOWN:")
-        logging.info(f"Identified foods: {', '.join(food_items)}")
-        logging.info(f"Portion multiplier: {portion_multiplier} ({portion_multiplier * 100:.0f}g per item)")
-        logging.info("-" * 60)
-        for item_data in nutrition_breakdown:
-            logging.info(f"Food: {item_data['food']} (~{item_data.get('portion_grams', 150):.0f}g)")
-            logging.info(f"  Calories: {item_data['nutrition']['calories']:.1f} kcal")
-            logging.info(f"  Protein: {item_data['nutrition']['protein']:.1f} g")
-            logging.info(f"  Fat: {item_data['nutrition']['fat']:.1f} g")
-            logging.info(f"  Carbs: {item_data['nutrition']['carbohydrates']:.1f} g")
-        logging.info("-" * 60)
-        logging.info(f"TOTAL NUTRITION:")
-        logging.info(f"  Calories: {total_nutrition['calories']:.1f} kcal")
-        logging.info(f"  Protein: {total_nutrition['protein']:.1f} g")
-        logging.info(f"  Fat: {total_nutrition['fat']:.1f} g")
-        logging.info(f"  Carbs: {total_nutrition['carbohydrates']:.1f} g")
-        logging.info("=" * 60)
-        
-        # Save meal to database
-        cursor = db.cursor()
-        cursor.execute('''
-            INSERT INTO meals (user_id, date, meal_type, food_items, calories, 
-                             protein, fat, carbohydrates, image_data, created_at)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (user_id, date_str, meal_type, ', '.join(food_items),
-              total_nutrition['calories'], total_nutrition['protein'],
-              total_nutrition['fat'], total_nutrition['carbohydrates'],
-              image_base64, datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
         
-        db.commit()
+        # One column-wise pass over the breakdown instead of per-item accumulation
+        total_nutrition = {
+            key: sum(entry["nutrition"][key] for entry in nutrition_breakdown)
+            for key in NUTRIENT_KEYS
+        }
         
-        # Update daily summary
-        update_daily_summary(user_id, date_str)
+        # One lazily formatted record; only stringified when DEBUG logging is on
+        logging.debug("Meal nutrition breakdown: %s", {
+            "foods": food_items,
+            "portion_multiplier": portion_multiplier,
+            "breakdown": nutrition_breakdown,
+            "total": total_nutrition,
+        })
+        
+        # Save meal and refresh the daily summary in one transaction
+        cursor = db.cursor()
+        with db:
+            cursor.execute(SQL_INSERT_PHOTO_MEAL, (user_id, date_str, meal_type, MEAL_TYPE_IDS.get(meal_type),
+                  ', '.join(food_items),
+                  total_nutrition['calories'], total_nutrition['protein'],
+                  total_nutrition['fat'], total_nutrition['carbohydrates'],
+                  store_meal_image(image_bytes), now.isoformat(' ', 'seconds')))
+            meal_id = cursor.lastrowid
+            update_daily_summary(user_id, date_str, cursor=cursor, commit=False)
         
         # Include breakdown in response for transparency
         return jsonify({
             "status": "success",
-            "meal_id": cursor.lastrowid,
+            "meal_id": meal_id,
             "meal_type": meal_type,
             "date": date_str,
             "food_items": food_items, 
@@ -1287,7 +1738,7 @@ def analyze_meal_with_photo(user_id, meal_type, date_str):
         logging.error(f"An unexpected error occurred during meal analysis: {e}", exc_info=True)
         return jsonify({"status": "error", "message": "An internal server error occurred."}), 500
 
-def add_manual_meal(user_id, data, date_str):
+def add_manual_meal(user_id, data, date_str, now):
     """Add meal with manual nutrition entry"""
     try:
         db = get_db()
@@ -1312,21 +1763,16 @@ def add_manual_meal(user_id, data, date_str):
         if calories > 5000:
             return jsonify({"status": "error", "message": "Calories value seems too high (max 5000)"}), 400
         
-        cursor.execute('''
-            INSERT INTO meals (user_id, date, meal_type, food_items, calories, 
-                             protein, fat, carbohydrates, created_at)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (user_id, date_str, meal_type, food_items, calories, protein, 
-              fat, carbohydrates, datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
-        
-        db.commit()
-        
-        # Update daily summary
-        update_daily_summary(user_id, date_str)
+        # Save meal and refresh the daily summary in one transaction
+        with db:
+            cursor.execute(SQL_INSERT_MANUAL_MEAL, (user_id, date_str, meal_type, MEAL_TYPE_IDS.get(meal_type), food_items, calories, protein, 
+                  fat, carbohydrates, now.isoformat(' ', 'seconds')))
+            meal_id = cursor.lastrowid
+            update_daily_summary(user_id, date_str, cursor=cursor, commit=False)
         
         return jsonify({
             "status": "success",
-            "meal_id": cursor.lastrowid,
+            "meal_id": meal_id,
             "message": "Meal added successfully"
         }), 201
         
@@ -1335,29 +1781,25 @@ def add_manual_meal(user_id, data, date_str):
         return jsonify({"status": "error", "message": "Failed to add meal"}), 500
 
 # --- ACTIVITY/EXERCISE ENDPOINTS ---
-@app.route('/api/activity', methods=['POST', 'GET', 'DELETE'])
-@login_required
+@api.route('/activity', methods=['POST', 'GET', 'DELETE'])
 def activity_route():
     try:
         user_id = session['user_id']
         db = get_db()
         cursor = db.cursor()
+        # One clock read per request, shared by the date default and created_at
+        now = datetime.now()
         
         if request.method == 'GET':
-            date_str = request.args.get('date', datetime.now().strftime("%Y-%m-%d"))
+            date_str = request.args.get('date') or now.date().isoformat()
             
-            cursor.execute('''
-                SELECT * FROM activities 
-                WHERE user_id = ? AND date = ?
-                ORDER BY created_at DESC
-            ''', (user_id, date_str))
+            cursor.execute(SQL_GET_ACTIVITIES_BY_DATE, (user_id, date_str))
             
-            activities = [dict(row) for row in cursor.fetchall()]
-            return jsonify(activities)
+            return stream_json_rows(cursor, db)
         
         elif request.method == 'POST':
             data = request.json
-            date_str = data.get('date', datetime.now().strftime("%Y-%m-%d"))
+            date_str = data.get('date') or now.date().isoformat()
             
             # Validation
             activity_name = data.get('activity_name', '').strip()
@@ -1373,21 +1815,16 @@ def activity_route():
             if calories_burned > 2000:
                 return jsonify({"status": "error", "message": "Calories burned seems too high (max 2000)"}), 400
             
-            cursor.execute('''
-                INSERT INTO activities (user_id, date, activity_name, duration_minutes, 
-                                      calories_burned, notes, created_at)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', (user_id, date_str, activity_name, duration_minutes,
-                  calories_burned, data.get('notes', ''),
-                  datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
-            
-            db.commit()
-            
-            # Update daily summary
-            update_daily_summary(user_id, date_str)
+            # Save activity and refresh the daily summary in one transaction
+            with db:
+                cursor.execute(SQL_INSERT_ACTIVITY, (user_id, date_str, activity_name, duration_minutes,
+                      calories_burned, data.get('notes', ''),
+                      now.isoformat(' ', 'seconds')))
+                activity_id = cursor.lastrowid
+                update_daily_summary(user_id, date_str, cursor=cursor, commit=False)
             
             logging.info(f"Activity added for user {user_id}: {activity_name}")
-            return jsonify({"status": "success", "activity_id": cursor.lastrowid}), 201
+            return jsonify({"status": "success", "activity_id": activity_id}), 201
         
         else:  # DELETE
             activity_id = request.args.get('id')
@@ -1396,18 +1833,16 @@ def activity_route():
                 return jsonify({"status": "error", "message": "Activity ID required"}), 400
             
             # Get date before deleting for summary update
-            cursor.execute('SELECT date FROM activities WHERE id = ? AND user_id = ?', 
-                          (activity_id, user_id))
+            cursor = tuple_cursor(db)
+            cursor.execute(SQL_GET_ACTIVITY_DATE, (activity_id, user_id))
             activity = cursor.fetchone()
             
             if activity:
-                date_str = activity['date']
-                cursor.execute('DELETE FROM activities WHERE id = ? AND user_id = ?', 
-                             (activity_id, user_id))
-                db.commit()
-                
-                # Update daily summary
-                update_daily_summary(user_id, date_str)
+                (date_str,) = activity
+                # Delete the activity and refresh the daily summary in one transaction
+                with db:
+                    cursor.execute(SQL_DELETE_ACTIVITY, (activity_id, user_id))
+                    update_daily_summary(user_id, date_str, cursor=cursor, commit=False)
                 
                 return jsonify({"status": "success", "message": "Activity deleted"}), 200
             
@@ -1418,81 +1853,59 @@ def activity_route():
         return jsonify({"status": "error", "message": "An error occurred"}), 500
 
 # --- DAILY SUMMARY ENDPOINT ---
-@app.route('/api/daily-summary/<date_str>')
-@login_required
+@api.route('/daily-summary/<date_str>')
 def daily_summary(date_str):
     user_id = session['user_id']
     db = get_db()
     cursor = db.cursor()
     
-    # Get or create daily summary
-    cursor.execute('''
-        SELECT * FROM daily_summary 
-        WHERE user_id = ? AND date = ?
-    ''', (user_id, date_str))
-    
-    summary = cursor.fetchone()
-    
-    if not summary:
-        # Create summary if doesn't exist
-        update_daily_summary(user_id, date_str)
-        cursor.execute('''
-            SELECT * FROM daily_summary 
-            WHERE user_id = ? AND date = ?
-        ''', (user_id, date_str))
-        summary = cursor.fetchone()
-    
-    # Get user's target calories
-    cursor.execute('SELECT target_calories FROM users WHERE id = ?', (user_id,))
-    user = cursor.fetchone()
+    # Summary and target in one read; days without a summary row are aggregated live
+    # rather than written here, since every meal/activity write refreshes the summary
+    cursor.execute(SQL_GET_DAILY_SUMMARY, (user_id, date_str))
     
-    result = dict(summary) if summary else {}
-    result['target_calories'] = user['target_calories'] if user else 2000
-    result['remaining_calories'] = result['target_calories'] - (result.get('total_calories_consumed', 0) - result.get('total_calories_burned', 0))
+    result = dict(cursor.fetchone())
+    result['remaining_calories'] = result['target_calories'] - (result['total_calories_consumed'] - result['total_calories_burned'])
     
     return jsonify(result)
 
 # --- CALENDAR DATA ENDPOINT ---
-@app.route('/api/calendar/<year>/<month>')
-@login_required
+@api.route('/calendar/<int:year>/<int:month>')
 def calendar_data(year, month):
     user_id = session['user_id']
-    db = get_db()
-    cursor = db.cursor()
     
-    # Get all daily summaries for the month
-    start_date = f"{year}-{month:02d}-01"
-    if int(month) == 12:
-        end_date = f"{int(year)+1}-01-01"
-    else:
-        end_date = f"{year}-{int(month)+1:02d}-01"
-    
-    cursor.execute('''
-        SELECT date, total_calories_consumed, total_calories_burned, net_calories
-        FROM daily_summary 
-        WHERE user_id = ? AND date >= ? AND date < ?
-    ''', (user_id, start_date, end_date))
+    # Get all daily summaries for the month: [first of month, first of next month)
+    try:
+        start_date = date(year, month, 1)
+    except ValueError:
+        return jsonify({"status": "error", "message": "Invalid year or month"}), 400
+    end_date = date(year + 1, 1, 1) if month == 12 else date(year, month + 1, 1)
     
-    summaries = [dict(row) for row in cursor.fetchall()]
+    db = get_db()
     
     # Get user's target for comparison
-    cursor.execute('SELECT target_calories FROM users WHERE id = ?', (user_id,))
+    cursor = tuple_cursor(db)
+    cursor.execute(SQL_GET_TARGET_CALORIES, (user_id,))
     user = cursor.fetchone()
-    target = user['target_calories'] if user else 2000
+    target = user[0] if user else 2000
+    
+    cursor = db.cursor()
+    cursor.execute(SQL_GET_MONTH_SUMMARIES, (user_id, start_date.isoformat(), end_date.isoformat()))
     
-    # Format for calendar display
-    calendar_data = {}
-    for summary in summaries:
-        day = int(summary['date'].split('-')[2])
-        calendar_data[day] = {
+    # Format for calendar display straight from the cursor
+    calendar_data = {
+        summary['day']: {
             'consumed': summary['total_calories_consumed'],
             'burned': summary['total_calories_burned'],
             'net': summary['net_calories'],
             'status': 'good' if summary['net_calories'] <= target else 'over'
         }
+        for summary in cursor
+    }
     
     return jsonify(calendar_data)
 
+app.register_blueprint(api)
+
 # --- MAIN EXECUTION ---
 # Initialize database on startup (for both local and production)
 with app.app_context():
@@ -1502,5 +1915,7 @@ with app.app_context():
     except Exception as e:
         logging.error(f"Error initializing database: {e}")
 
+start_background_jobs()
+
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0', port=5001)
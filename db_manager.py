@@ -4,64 +4,148 @@ Database Manager for Health Tracker
 Use this script to manage users and view database contents
 """
 
+import atexit
 import sqlite3
 import sys
-from datetime import datetime
 from werkzeug.security import generate_password_hash
 
+_conn = None
+
+# Seconds a stats_cache row (created by app.init_db) is served before view_user_stats re-aggregates
+STATS_CACHE_TTL = 60
+
+# --- SQL STATEMENTS ---
+# Hoisted so repeated calls from the menu loop hand sqlite3 the same string
+# and hit the connection's statement cache instead of re-parsing
+# Tables this script reads; any missing means app.init_db hasn't run on this file yet
+SQL_COUNT_SCHEMA_TABLES = "SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name IN ('users', 'stats_cache')"
+SQL_LIST_USERS = 'SELECT id, username, email, name, created_at, target_calories FROM users'
+SQL_GET_USER_ID = 'SELECT id FROM users WHERE username = ?'
+SQL_GET_USER_FOR_STATS = 'SELECT id, name, target_calories FROM users WHERE username = ?'
+# created_at is stamped by SQLite in local time, matching the app's signup
+SQL_INSERT_USER = '''
+    INSERT INTO users (username, password_hash, email, name, created_at, target_calories)
+    VALUES (?, ?, ?, ?, strftime('%Y-%m-%d %H:%M:%S', 'now', 'localtime'), ?)
+    ON CONFLICT (username) DO NOTHING
+'''
+SQL_DELETE_USER = 'DELETE FROM users WHERE id = ?'
+# All counts, the latest weight and the average in one round-trip; binds user_id five times
+SQL_GET_USER_STATS = '''
+    SELECT (SELECT COUNT(*) FROM meals WHERE user_id = ?),
+           (SELECT COUNT(*) FROM activities WHERE user_id = ?),
+           (SELECT COUNT(*) FROM vitals WHERE user_id = ?),
+           (SELECT weight FROM vitals WHERE user_id = ? ORDER BY date DESC LIMIT 1),
+           (SELECT AVG(total_calories_consumed) FROM daily_summary WHERE user_id = ?)
+'''
+SQL_GET_CACHED_STATS = '''
+    SELECT meals_count, activities_count, vitals_count, weight, avg_calories
+    FROM stats_cache
+    WHERE user_id = ? AND computed_at > CAST(strftime('%s', 'now') AS INTEGER) - ?
+'''
+SQL_CACHE_STATS = '''
+    INSERT OR REPLACE INTO stats_cache
+    (user_id, computed_at, meals_count, activities_count, vitals_count, weight, avg_calories)
+    VALUES (?, CAST(strftime('%s', 'now') AS INTEGER), ?, ?, ?, ?, ?)
+'''
+
+MENU = "\n".join([
+    "\n" + "=" * 60,
+    "🏥 HEALTH TRACKER DATABASE MANAGER",
+    "=" * 60,
+    "1. List all users",
+    "2. Create a user",
+    "3. Delete a user",
+    "4. View user statistics",
+    "5. Reset database (delete all data)",
+    "6. Exit",
+    "-" * 60,
+])
+
+def prompt(text):
+    """input() for a terminal; piped stdin is read directly, skipping line editing"""
+    if sys.stdin.isatty():
+        return input(text)
+    sys.stdout.write(text)
+    sys.stdout.flush()
+    line = sys.stdin.readline()
+    if not line:
+        raise EOFError
+    return line.rstrip('\n')
+
 def connect_db():
-    """Connect to the database"""
-    return sqlite3.connect('database.db')
+    """Return the shared database connection, opening it on first use"""
+    global _conn
+    if _conn is None:
+        _conn = sqlite3.connect('database.db', check_same_thread=False)
+        # A fresh or outdated file gets its schema first, so read-only commands
+        # report an empty database instead of failing on a missing table
+        if _conn.execute(SQL_COUNT_SCHEMA_TABLES).fetchone()[0] < 2:
+            ensure_schema()
+        # Per-connection settings, applied once since the connection is reused
+        _conn.execute("PRAGMA journal_mode=WAL")
+        _conn.execute("PRAGMA synchronous=NORMAL")
+        _conn.execute("PRAGMA temp_store=MEMORY")
+        _conn.execute("PRAGMA cache_size=-64000")
+        _conn.execute("PRAGMA mmap_size=268435456")
+        _conn.execute("PRAGMA foreign_keys=ON")
+        atexit.register(_conn.close)
+    return _conn
+
+def ensure_schema():
+    """Create any missing tables; imports the whole Flask app, so only paths that may start from an empty database call it"""
+    from app import init_db
+    init_db()
 
 def list_users():
     """List all users in the database"""
     db = connect_db()
     cursor = db.cursor()
     
-    cursor.execute('SELECT id, username, email, name, created_at, target_calories FROM users')
-    users = cursor.fetchall()
+    cursor.arraysize = 256
+    cursor.execute(SQL_LIST_USERS)
     
+    users = cursor.fetchmany()
     if not users:
         print("📭 No users in database")
         return
     
-    print("\n👥 USERS IN DATABASE:")
-    print("=" * 80)
-    for user in users:
-        print(f"ID: {user[0]}")
-        print(f"  Username: {user[1]}")
-        print(f"  Email: {user[2] or 'Not provided'}")
-        print(f"  Name: {user[3] or 'Not provided'}")
-        print(f"  Target Calories: {user[5]}")
-        print(f"  Created: {user[4]}")
-        print("-" * 40)
-    
-    db.close()
+    # Stream one write per batch: output starts with the first rows and memory
+    # stays bounded by arraysize instead of the whole table
+    sys.stdout.write("\n👥 USERS IN DATABASE:\n" + "=" * 80 + "\n")
+    while users:
+        sys.stdout.write("".join(
+            f"ID: {user[0]}\n"
+            f"  Username: {user[1]}\n"
+            f"  Email: {user[2] or 'Not provided'}\n"
+            f"  Name: {user[3] or 'Not provided'}\n"
+            f"  Target Calories: {user[5]}\n"
+            f"  Created: {user[4]}\n"
+            + "-" * 40 + "\n"
+            for user in users
+        ))
+        users = cursor.fetchmany()
 
 def create_user(username, password, email=None, name=None):
     """Create a new user"""
     db = connect_db()
     cursor = db.cursor()
     
-    # Check if user exists
-    cursor.execute('SELECT id FROM users WHERE username = ?', (username,))
+    # Cheap check first so a duplicate never pays for the password hash
+    cursor.execute(SQL_GET_USER_ID, (username,))
     if cursor.fetchone():
         print(f"❌ User '{username}' already exists")
-        db.close()
         return
     
     # Create user
     password_hash = generate_password_hash(password)
-    created_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     
-    cursor.execute('''
-        INSERT INTO users (username, password_hash, email, name, created_at, target_calories)
-        VALUES (?, ?, ?, ?, ?, ?)
-    ''', (username, password_hash, email, name or username, created_at, 2000))
-    
-    db.commit()
+    # The upsert settles a race with another writer without raising
+    with db:
+        cursor.execute(SQL_INSERT_USER, (username, password_hash, email, name or username, 2000))
+    if cursor.rowcount == 0:
+        print(f"❌ User '{username}' already exists")
+        return
     print(f"✅ User '{username}' created successfully!")
-    db.close()
 
 def delete_user(username):
     """Delete a user and all their data"""
@@ -69,26 +153,21 @@ def delete_user(username):
     cursor = db.cursor()
     
     # Get user ID
-    cursor.execute('SELECT id FROM users WHERE username = ?', (username,))
+    cursor.execute(SQL_GET_USER_ID, (username,))
     user = cursor.fetchone()
     
     if not user:
         print(f"❌ User '{username}' not found")
-        db.close()
         return
     
     user_id = user[0]
     
-    # Delete all user data
-    cursor.execute('DELETE FROM meals WHERE user_id = ?', (user_id,))
-    cursor.execute('DELETE FROM activities WHERE user_id = ?', (user_id,))
-    cursor.execute('DELETE FROM vitals WHERE user_id = ?', (user_id,))
-    cursor.execute('DELETE FROM daily_summary WHERE user_id = ?', (user_id,))
-    cursor.execute('DELETE FROM users WHERE id = ?', (user_id,))
+    # Meals, activities, vitals and summaries cascade from the users row
+    # (foreign keys on new databases, app.init_db's trigger on older ones)
+    with db:
+        cursor.execute(SQL_DELETE_USER, (user_id,))
     
-    db.commit()
     print(f"✅ User '{username}' and all their data deleted")
-    db.close()
 
 def view_user_stats(username):
     """View statistics for a specific user"""
@@ -96,12 +175,11 @@ def view_user_stats(username):
     cursor = db.cursor()
     
     # Get user
-    cursor.execute('SELECT id, name, target_calories FROM users WHERE username = ?', (username,))
+    cursor.execute(SQL_GET_USER_FOR_STATS, (username,))
     user = cursor.fetchone()
     
     if not user:
         print(f"❌ User '{username}' not found")
-        db.close()
         return
     
     user_id = user[0]
@@ -109,97 +187,75 @@ def view_user_stats(username):
     print(f"\n📊 STATS FOR: {user[1] or username}")
     print("=" * 60)
     
-    # Count meals
-    cursor.execute('SELECT COUNT(*) FROM meals WHERE user_id = ?', (user_id,))
-    meals_count = cursor.fetchone()[0]
-    print(f"🍽️  Total meals logged: {meals_count}")
+    cursor.execute(SQL_GET_CACHED_STATS, (user_id, STATS_CACHE_TTL))
+    stats = cursor.fetchone()
+    if stats is None:
+        cursor.execute(SQL_GET_USER_STATS, (user_id,) * 5)
+        stats = cursor.fetchone()
+        with db:
+            cursor.execute(SQL_CACHE_STATS, (user_id, *stats))
+    meals_count, activities_count, vitals_count, weight, avg_calories = stats
     
-    # Count activities
-    cursor.execute('SELECT COUNT(*) FROM activities WHERE user_id = ?', (user_id,))
-    activities_count = cursor.fetchone()[0]
+    print(f"🍽️  Total meals logged: {meals_count}")
     print(f"🏃 Total activities logged: {activities_count}")
-    
-    # Count vitals entries
-    cursor.execute('SELECT COUNT(*) FROM vitals WHERE user_id = ?', (user_id,))
-    vitals_count = cursor.fetchone()[0]
     print(f"📈 Total vitals entries: {vitals_count}")
+    if weight is not None:
+        print(f"⚖️  Latest weight: {weight} kg")
     
-    # Get latest weight
-    cursor.execute('SELECT weight FROM vitals WHERE user_id = ? ORDER BY date DESC LIMIT 1', (user_id,))
-    weight = cursor.fetchone()
-    if weight:
-        print(f"⚖️  Latest weight: {weight[0]} kg")
-    
-    # Get average daily calories
-    cursor.execute('''
-        SELECT AVG(total_calories_consumed) 
-        FROM daily_summary 
-        WHERE user_id = ?
-    ''', (user_id,))
-    avg_calories = cursor.fetchone()[0]
     if avg_calories:
         print(f"🔥 Average daily calories: {avg_calories:.0f}")
         print(f"🎯 Target calories: {user[2]}")
-    
-    db.close()
 
 def reset_database():
     """Reset the entire database (delete all data)"""
-    response = input("⚠️  This will DELETE ALL DATA. Are you sure? (yes/no): ")
+    response = prompt("⚠️  This will DELETE ALL DATA. Are you sure? (yes/no): ")
     if response.lower() != 'yes':
         print("❌ Cancelled")
         return
     
     db = connect_db()
-    cursor = db.cursor()
-    
-    # Delete all data from all tables
-    cursor.execute('DELETE FROM meals')
-    cursor.execute('DELETE FROM activities')
-    cursor.execute('DELETE FROM vitals')
-    cursor.execute('DELETE FROM daily_summary')
-    cursor.execute('DELETE FROM api_cache')
-    cursor.execute('DELETE FROM food_cache')
-    cursor.execute('DELETE FROM users')
     
-    db.commit()
+    # Delete all data from all tables in one transaction; child tables go first
+    # so the users delete has nothing left to cascade
+    db.executescript('''
+        BEGIN;
+        DELETE FROM meals;
+        DELETE FROM activities;
+        DELETE FROM vitals;
+        DELETE FROM daily_summary;
+        DELETE FROM api_cache;
+        DELETE FROM food_cache;
+        DELETE FROM stats_cache;
+        DELETE FROM users;
+        COMMIT;
+    ''')
     print("✅ Database reset - all data deleted")
-    db.close()
 
 def main():
     """Main menu"""
     while True:
-        print("\n" + "=" * 60)
-        print("🏥 HEALTH TRACKER DATABASE MANAGER")
-        print("=" * 60)
-        print("1. List all users")
-        print("2. Create a user")
-        print("3. Delete a user")
-        print("4. View user statistics")
-        print("5. Reset database (delete all data)")
-        print("6. Exit")
-        print("-" * 60)
+        print(MENU)
         
-        choice = input("Select option (1-6): ")
+        choice = prompt("Select option (1-6): ")
         
         if choice == '1':
             list_users()
         
         elif choice == '2':
-            username = input("Username: ")
-            password = input("Password: ")
-            email = input("Email (optional): ") or None
-            name = input("Full name (optional): ") or None
+            username = prompt("Username: ")
+            password = prompt("Password: ")
+            email = prompt("Email (optional): ") or None
+            name = prompt("Full name (optional): ") or None
             create_user(username, password, email, name)
         
         elif choice == '3':
-            username = input("Username to delete: ")
-            confirm = input(f"Delete '{username}' and all their data? (yes/no): ")
+            username = prompt("Username to delete: ")
+            confirm = prompt(f"Delete '{username}' and all their data? (yes/no): ")
             if confirm.lower() == 'yes':
                 delete_user(username)
         
         elif choice == '4':
-            username = input("Username to view: ")
+            username = prompt("Username to view: ")
             view_user_stats(username)
         
         elif choice == '5':
@@ -213,10 +269,6 @@ def main():
             print("❌ Invalid option")
 
 if __name__ == "__main__":
-    # Initialize database if needed
-    from app import init_db
-    init_db()
-    
     # Check for command line arguments
     if len(sys.argv) > 1:
         if sys.argv[1] == 'list':
@@ -226,12 +278,14 @@ if __name__ == "__main__":
             password = sys.argv[3]
             email = sys.argv[4] if len(sys.argv) > 4 else None
             name = sys.argv[5] if len(sys.argv) > 5 else None
+            ensure_schema()
             create_user(username, password, email, name)
         elif sys.argv[1] == 'delete' and len(sys.argv) >= 3:
             delete_user(sys.argv[2])
         elif sys.argv[1] == 'stats' and len(sys.argv) >= 3:
             view_user_stats(sys.argv[2])
         elif sys.argv[1] == 'reset':
+            ensure_schema()
             reset_database()
         else:
             print("Usage:")
@@ -242,4 +296,5 @@ if __name__ == "__main__":
             print("  python db_manager.py stats <username>   # View user stats")
             print("  python db_manager.py reset              # Reset database")
     else:
+        ensure_schema()
         main()